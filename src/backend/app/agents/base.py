@@ -1,10 +1,16 @@
-from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+import inspect
+from typing import Dict, Any, AsyncIterator, List
 from app.core.agent_registry import AgentRegistry
 from app.models.agent_metadata import AgentMetadata, IntentType
 
 
-class BaseAgent(ABC):
+class BaseAgent:
+    def __init_subclass__(cls, **kwargs):
+        """Check once, at class creation, that the agent implements process as a coroutine"""
+        super().__init_subclass__(**kwargs)
+        if not inspect.iscoroutinefunction(getattr(cls, 'process', None)):
+            raise TypeError(f"{cls.__name__} must define 'async def process(self, context)'")
+    
     def __init__(
         self,
         name: str,
@@ -26,10 +32,13 @@ class BaseAgent(ABC):
         )
         AgentRegistry().register(self.metadata)
     
-    @abstractmethod
-    async def process(self, context: Dict[str, Any]) -> Dict[str, Any]:
-        """Process the request and return response"""
-        pass
+    # Subclasses implement: async def process(self, context: Dict[str, Any]) -> Dict[str, Any]
+    
+    async def stream(self, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the response as frames: {"delta": text} chunks followed by the full
+        response dict with "done": True. Agents that can't stream send only the final frame."""
+        result = await self.process(context)
+        yield {**result, "done": True}
     
     async def health_check(self) -> Dict[str, Any]:
         """Check agent health"""
@@ -0,0 +1,99 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.agent_registry import AgentRegistry
+from app.models.agent_metadata import AgentMetadata, IntentType
+from app.rag.embeddings import EmbeddingService
+
+_GREETING_RE = re.compile(
+    r"^(oi|ol[aá]|eae|e a[ií]|hello|hi|hey|bom dia|boa tarde|boa noite|"
+    r"good (morning|afternoon|evening))[\s!.,?]*$",
+    re.IGNORECASE
+)
+
+
+# Centroid for small talk that should get a direct reply instead of an agent
+_CASUAL_DESCRIPTION = (
+    "casual conversation, small talk. thanks, thank you, obrigado, obrigada, valeu. "
+    "how are you, tudo bem, como vai. ok, okay, beleza, bye, tchau, até logo"
+)
+
+
+def is_greeting(message: str) -> bool:
+    """Check if the message is only a greeting"""
+    return _GREETING_RE.match(message.strip()) is not None
+
+
+class IntentClassifier:
+    """Local intent classifier: greeting regex plus nearest intent centroid by cosine similarity.
+    Only answers when the best centroid is both similar enough and clearly ahead of the runner-up."""
+
+    def __init__(
+        self,
+        registry: AgentRegistry,
+        embedding_service: EmbeddingService,
+        min_similarity: float = 0.65,
+        min_margin: float = 0.05
+    ):
+        self.registry = registry
+        self.embedding_service = embedding_service
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._signature: Optional[Tuple] = None
+        # None stands for the casual (no agent) centroid
+        self._intents: List[Optional[IntentType]] = []
+        self._centroids: Optional[np.ndarray] = None
+
+    @staticmethod
+    def _describe_intent(intent: IntentType, agents: List[AgentMetadata]) -> str:
+        """Build the text embedded as the centroid of an intent"""
+        parts = [intent.value.replace("_", " ")]
+        for agent in agents:
+            parts.append(agent.description)
+            parts.append(", ".join(agent.capabilities).replace("_", " "))
+        return ". ".join(parts)
+
+    async def _intent_matrix(self) -> Tuple[List[Optional[IntentType]], Optional[np.ndarray]]:
+        """Get the intent centroid matrix, rebuilding it when registered agents change"""
+        available_intents: Dict[IntentType, List[AgentMetadata]] = self.registry.get_available_intents()
+        signature = tuple(
+            (intent, tuple(agent.name for agent in agents))
+            for intent, agents in available_intents.items()
+        )
+
+        if signature != self._signature:
+            intents: List[Optional[IntentType]] = list(available_intents.keys())
+            centroids = None
+            if intents:
+                texts = [self._describe_intent(intent, available_intents[intent]) for intent in intents]
+                intents.append(None)
+                texts.append(_CASUAL_DESCRIPTION)
+                vectors = np.asarray(await self.embedding_service.embed_batch(texts), dtype=np.float32)
+                centroids = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            self._intents, self._centroids, self._signature = intents, centroids, signature
+
+        return self._intents, self._centroids
+
+    async def classify(self, message: str) -> Optional[Tuple[IntentType, bool, float]]:
+        """Classify message locally. Returns (intent, needs_agent, score), or None
+        when the classifier is not confident and the caller should fall back to the LLM."""
+        if is_greeting(message):
+            return IntentType.GENERAL_QUESTION, False, 1.0
+
+        intents, centroids = await self._intent_matrix()
+        if centroids is None:
+            return None
+
+        query = np.asarray(await self.embedding_service.embed_query(message), dtype=np.float32)
+        query /= np.linalg.norm(query)
+        scores = centroids @ query
+        runner_up, best = np.argsort(scores)[-2:]
+        score = float(scores[best])
+
+        if score < self.min_similarity or score - float(scores[runner_up]) < self.min_margin:
+            return None
+        if intents[best] is None:
+            return IntentType.GENERAL_QUESTION, False, score
+        return intents[best], True, score
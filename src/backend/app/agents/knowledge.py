@@ -1,21 +1,34 @@
-from typing import Dict, Any
-import sys
-from pathlib import Path
-from datetime import datetime
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+import time
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 
 from app.agents.base import BaseAgent
+from app.core.circuit_breaker import CircuitOpenError
+from app.core.llm_pool import get_llm, llm_breaker
 from app.models.agent_metadata import IntentType
 from app.rag.retriever import Retriever
 from app.utils.logger import setup_logger
-
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+from app.core.config import settings
 
 logger = setup_logger("knowledge_agent")
 
+_CONTEXT_PROMPT_TEMPLATE = """You are an expert assistant that answers questions using provided documentation.
+Always respond in the language used by the user.
+
+Context from documentation:
+{context}
+
+User question: "{query}"
+
+Instructions:
+- Answer ONLY using the provided context
+- If the context doesn't contain enough information, say so clearly
+- Always cite your sources by mentioning the URL
+- Be accurate and concise
+
+Answer:"""
+
 
 class KnowledgeAgent(BaseAgent):
     def __init__(self):
@@ -27,129 +40,160 @@ class KnowledgeAgent(BaseAgent):
             priority=3,
             requires_user_id=False
         )
-        self.llm = ChatGoogleGenerativeAI(
-            model=settings.GEMINI_MODEL,
-            google_api_key=settings.GEMINI_API_KEY,
-            temperature=settings.KNOWLEDGE_TEMPERATURE
-        )
+        self.llm = get_llm(settings.KNOWLEDGE_TEMPERATURE)
         self.retriever = Retriever()
     
-    def _build_context_prompt(self, chunks: list, query: str) -> str:
+    def _build_context_prompt(self, chunks: list, query: str) -> Tuple[str, List[str]]:
         """Build prompt with retrieved context"""
-        context_text = "\n\n---\n\n".join([
-            f"Source: {chunk['metadata'].get('url', 'Unknown')}\n{chunk['text']}"
-            for chunk in chunks
-        ])
-        
-        sources = list(set([
-            chunk['metadata'].get('url', '')
-            for chunk in chunks
-            if chunk['metadata'].get('url')
-        ]))
-        
-        sources_text = "\n".join([f"- {url}" for url in sources])
+        parts = []
+        seen_urls = {}
+        for chunk in chunks:
+            url = chunk['metadata'].get('url') or 'Unknown'
+            parts.append(f"Source: {url}\n{chunk['text']}")
+            if url != 'Unknown':
+                seen_urls[url] = None
         
-        prompt = f"""You are an expert assistant that answers questions using provided documentation.
-Always respond in the language used by the user.
-
-Context from documentation:
-{context_text}
-
-User question: "{query}"
-
-Instructions:
-- Answer ONLY using the provided context
-- If the context doesn't contain enough information, say so clearly
-- Always cite your sources by mentioning the URL
-- Be accurate and concise
-
-Answer:"""
+        prompt = _CONTEXT_PROMPT_TEMPLATE.format(
+            context="\n\n---\n\n".join(parts),
+            query=query
+        )
         
-        return prompt, sources
+        return prompt, list(seen_urls)
     
-    async def process(self, context: Dict[str, Any]) -> Dict[str, Any]:
-        """Process knowledge requests using RAG"""
-        start_time = datetime.now()
-        message = context.get("message", "")
+    async def _prepare(
+        self,
+        message: str
+    ) -> Tuple[Optional[Dict[str, Any]], list, str, List[str]]:
+        """Retrieve context and build the prompt.
+        Returns (early_result, chunks, prompt, sources); early_result is set when
+        there is nothing to send to the LLM (quota exceeded or no relevant chunks)."""
+        logger.info("Knowledge Agent - Retrieving context for: '%.100s...'", message)
         
         try:
-            logger.info(f"Knowledge Agent - Retrieving context for: '{message[:100]}...'")
-            
-            try:
-                chunks, sources = await self.retriever.retrieve_with_sources(message)
-            except Exception as e:
-                error_str = str(e)
-                if "quota" in error_str.lower() or "429" in error_str:
-                    logger.error(f"Quota exceeded for embeddings: {error_str}")
-                    return {
-                        "response": "I'm currently unable to search our documentation due to API rate limits. Please try again in a few moments. / No momento, não consigo buscar em nossa documentação devido a limites de API. Por favor, tente novamente em alguns instantes.",
-                        "agent": self.name,
-                        "metadata": {
-                            "sources": [],
-                            "chunks_retrieved": 0,
-                            "confidence": 0.0,
-                            "processing_time_ms": 0,
-                            "error": "quota_exceeded"
-                        }
-                    }
-                raise
-            
-            if not chunks:
-                logger.warning(f"No relevant chunks found for query: '{message[:100]}...'")
-                return {
-                    "response": "I don't have specific information about that in our documentation. Could you rephrase your question? / Não tenho informações específicas sobre isso em nossa documentação. Você poderia reformular sua pergunta?",
-                    "agent": self.name,
-                    "metadata": {
-                        "sources": [],
-                        "chunks_retrieved": 0,
-                        "confidence": 0.0,
-                        "processing_time_ms": 0
-                    }
-                }
-            
-            logger.info(f"Retrieved {len(chunks)} chunks with {len(sources)} unique sources")
-            
-            prompt, sources_list = self._build_context_prompt(chunks, message)
-            
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            final_response = response.content
-            
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
-            
-            logger.info(
-                f"Knowledge Agent Response - Query: '{message[:100]}...' | "
-                f"Chunks: {len(chunks)} | "
-                f"Sources: {len(sources_list)} | "
-                f"Response Length: {len(final_response)} chars | "
-                f"Processing Time: {int(processing_time)}ms"
-            )
-            
-            return {
-                "response": final_response,
-                "agent": self.name,
-                "metadata": {
-                    "sources": sources_list,
-                    "chunks_retrieved": len(chunks),
-                    "confidence": 0.9 if chunks else 0.3,
-                    "processing_time_ms": int(processing_time)
-                }
-            }
+            chunks, sources = await self.retriever.retrieve_with_sources(message)
         except Exception as e:
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
-            logger.error(
-                f"Knowledge Agent Error - Query: '{message[:100]}...' | "
-                f"Error: {str(e)} | "
-                f"Processing Time: {int(processing_time)}ms"
-            )
+            error_str = str(e)
+            if isinstance(e, CircuitOpenError) or "quota" in error_str.lower() or "429" in error_str:
+                logger.error("Quota exceeded for embeddings: %s", error_str)
+                return self._quota_result(), [], "", []
+            raise
+        
+        if not chunks:
+            logger.warning("No relevant chunks found for query: '%.100s...'", message)
             return {
-                "response": f"I encountered an error while searching our documentation. Please try again. / Encontrei um erro ao buscar em nossa documentação. Por favor, tente novamente. Error: {str(e)}",
+                "response": "I don't have specific information about that in our documentation. Could you rephrase your question? / Não tenho informações específicas sobre isso em nossa documentação. Você poderia reformular sua pergunta?",
                 "agent": self.name,
                 "metadata": {
                     "sources": [],
                     "chunks_retrieved": 0,
                     "confidence": 0.0,
-                    "processing_time_ms": int(processing_time),
-                    "error": str(e)
+                    "processing_time_ms": 0
                 }
+            }, [], "", []
+        
+        logger.info("Retrieved %d chunks with %d unique sources", len(chunks), len(sources))
+        
+        prompt, sources_list = self._build_context_prompt(chunks, message)
+        return None, chunks, prompt, sources_list
+    
+    def _quota_result(self) -> Dict[str, Any]:
+        """Build the response dict returned while the provider is rate limiting us"""
+        return {
+            "response": "I'm currently unable to search our documentation due to API rate limits. Please try again in a few moments. / No momento, não consigo buscar em nossa documentação devido a limites de API. Por favor, tente novamente em alguns instantes.",
+            "agent": self.name,
+            "metadata": {
+                "sources": [],
+                "chunks_retrieved": 0,
+                "confidence": 0.0,
+                "processing_time_ms": 0,
+                "error": "quota_exceeded"
             }
-
+        }
+    
+    def _build_result(
+        self,
+        message: str,
+        final_response: str,
+        chunks: list,
+        sources_list: List[str],
+        start_ns: int
+    ) -> Dict[str, Any]:
+        """Build the response dict for a generated answer"""
+        processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+        
+        logger.info(
+            "Knowledge Agent Response - Query: '%.100s...' | Chunks: %d | Sources: %d | "
+            "Response Length: %d chars | Processing Time: %dms",
+            message, len(chunks), len(sources_list), len(final_response), processing_time
+        )
+        
+        return {
+            "response": final_response,
+            "agent": self.name,
+            "metadata": {
+                "sources": sources_list,
+                "chunks_retrieved": len(chunks),
+                "confidence": 0.9 if chunks else 0.3,
+                "processing_time_ms": int(processing_time)
+            }
+        }
+    
+    def _build_error_result(self, message: str, error: Exception, start_ns: int) -> Dict[str, Any]:
+        """Build the response dict for a failed request"""
+        processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+        logger.error(
+            "Knowledge Agent Error - Query: '%.100s...' | Error: %s | Processing Time: %dms",
+            message, error, processing_time
+        )
+        return {
+            "response": f"I encountered an error while searching our documentation. Please try again. / Encontrei um erro ao buscar em nossa documentação. Por favor, tente novamente. Error: {str(error)}",
+            "agent": self.name,
+            "metadata": {
+                "sources": [],
+                "chunks_retrieved": 0,
+                "confidence": 0.0,
+                "processing_time_ms": int(processing_time),
+                "error": str(error)
+            }
+        }
+    
+    async def process(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Process knowledge requests using RAG"""
+        start_ns = time.perf_counter_ns()
+        message = context.get("message", "")
+        
+        try:
+            early_result, chunks, prompt, sources_list = await self._prepare(message)
+            if early_result is not None:
+                return early_result
+            
+            response = await llm_breaker.call(self.llm.ainvoke, [HumanMessage(content=prompt)])
+            return self._build_result(message, response.content, chunks, sources_list, start_ns)
+        except CircuitOpenError:
+            return self._quota_result()
+        except Exception as e:
+            return self._build_error_result(message, e, start_ns)
+    
+    async def stream(self, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream knowledge answers token by token as the LLM generates them"""
+        start_ns = time.perf_counter_ns()
+        message = context.get("message", "")
+        
+        try:
+            early_result, chunks, prompt, sources_list = await self._prepare(message)
+            if early_result is not None:
+                yield {**early_result, "done": True}
+                return
+            
+            parts = []
+            async for chunk in llm_breaker.stream(self.llm.astream, [HumanMessage(content=prompt)]):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {"delta": chunk.content}
+            
+            result = self._build_result(message, "".join(parts), chunks, sources_list, start_ns)
+            yield {**result, "done": True}
+        except CircuitOpenError:
+            yield {**self._quota_result(), "done": True}
+        except Exception as e:
+            yield {**self._build_error_result(message, e, start_ns), "done": True}
@@ -1,21 +1,38 @@
-from typing import Dict, Any, List, Tuple
-import sys
+from typing import Dict, Any, AsyncIterator, List, Optional, Sequence, Tuple
+import re
+import time
+import logging
 import asyncio
-from pathlib import Path
+from collections import OrderedDict
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 
 from app.agents.base import BaseAgent
+from app.core.llm_pool import get_llm, llm_breaker
+from app.agents.intent_classifier import IntentClassifier
 from app.core.agent_registry import AgentRegistry
 from app.models.agent_metadata import IntentType
+from app.rag.embed_cache import normalize_query
+from app.rag.embeddings import EmbeddingService
 from app.utils.logger import setup_logger
-
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+from app.core.config import settings
 
 logger = setup_logger("router_agent")
 
+_INTENT_RE = re.compile(r"intent:\s*(\w+)(?:.*?needs_agent:\s*(true|false))?", re.I | re.S)
+
+_COMBINE_MIN_CHARS = 400
+_COMBINE_MAX_SIMILARITY = 0.7
+
+
+def _token_jaccard(a: str, b: str) -> float:
+    """Jaccard similarity between the lowercase token sets of two texts"""
+    tokens_a = set(a.lower().split())
+    tokens_b = set(b.lower().split())
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
 
 class RouterAgent(BaseAgent):
     def __init__(self):
@@ -26,14 +43,35 @@ class RouterAgent(BaseAgent):
             capabilities=["routing", "intent_classification"]
         )
         self.registry = AgentRegistry()
-        self.llm = ChatGoogleGenerativeAI(
-            model=settings.GEMINI_MODEL,
-            google_api_key=settings.GEMINI_API_KEY,
-            temperature=settings.ROUTER_TEMPERATURE
+        self.llm = get_llm(settings.ROUTER_TEMPERATURE)
+        self.intent_classifier = IntentClassifier(
+            self.registry,
+            EmbeddingService(),
+            min_similarity=settings.INTENT_MIN_SIMILARITY,
+            min_margin=settings.INTENT_MIN_MARGIN
         )
+        self._agent_semaphore = asyncio.Semaphore(settings.ROUTER_MAX_CONCURRENT_AGENTS)
+        self._decisions: "OrderedDict[str, Tuple[IntentType, bool]]" = OrderedDict()
+    
+    def _remember_decision(self, message: str, intent: IntentType, needs_agent: bool):
+        """Store a successful classification so a repeated message skips classification"""
+        key = normalize_query(message)
+        self._decisions[key] = (intent, needs_agent)
+        self._decisions.move_to_end(key)
+        while len(self._decisions) > settings.ROUTER_DECISION_CACHE_SIZE:
+            self._decisions.popitem(last=False)
+    
+    def _cached_decision(self, message: str) -> Optional[Tuple[IntentType, bool]]:
+        """Get the previous routing decision for the same message, if any"""
+        key = normalize_query(message)
+        decision = self._decisions.get(key)
+        if decision is not None:
+            self._decisions.move_to_end(key)
+        return decision
     
     async def _classify_intent(self, message: str) -> Tuple[IntentType, bool]:
         """Classify user message intent and determine if agent is needed.
+        Tries the local classifier first and only asks the LLM when it is not confident.
         Dynamically builds prompt based on registered agents in the registry.
         Returns (intent, needs_agent)"""
         
@@ -42,6 +80,22 @@ class RouterAgent(BaseAgent):
         if not available_intents:
             return IntentType.GENERAL_QUESTION, False
         
+        try:
+            local_result = await self.intent_classifier.classify(message)
+        except Exception as e:
+            logger.warning("Local intent classification failed, falling back to LLM: %s", e)
+            local_result = None
+        
+        if local_result is not None:
+            intent, needs_agent, score = local_result
+            self._remember_decision(message, intent, needs_agent)
+            logger.info(
+                "Intent Classification (local) - Message: '%.100s...' | Intent: %s | "
+                "Needs Agent: %s | Score: %.2f",
+                message, intent.value, needs_agent, score
+            )
+            return intent, needs_agent
+        
         intent_categories = []
         for intent, agents in available_intents.items():
             agent_names = [agent.name for agent in agents]
@@ -72,59 +126,48 @@ class RouterAgent(BaseAgent):
         If it's just a greeting or casual conversation, set needs_agent to false."""
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            response_text = response.content.strip().lower()
+            response = await llm_breaker.call(self.llm.ainvoke, [HumanMessage(content=prompt)])
             
             intent_str = None
             needs_agent = True
             
-            for line in response_text.split('\n'):
-                if 'intent:' in line:
-                    intent_str = line.split('intent:')[1].strip()
-                elif 'needs_agent:' in line:
-                    needs_agent_str = line.split('needs_agent:')[1].strip()
-                    needs_agent = needs_agent_str == 'true'
+            match = _INTENT_RE.search(response.content)
+            if match:
+                intent_str = match.group(1).lower()
+                if match.group(2):
+                    needs_agent = match.group(2).lower() == 'true'
             
             dynamic_intent_map = {intent.value: intent for intent in available_intents.keys()}
             dynamic_intent_map["casual_greeting"] = IntentType.GENERAL_QUESTION
             
             intent = dynamic_intent_map.get(intent_str, IntentType.GENERAL_QUESTION)
+            self._remember_decision(message, intent, needs_agent)
             
             logger.info(
-                f"Intent Classification - Message: '{message[:100]}...' | "
-                f"Intent: {intent.value} | Needs Agent: {needs_agent}"
+                "Intent Classification - Message: '%.100s...' | Intent: %s | Needs Agent: %s",
+                message, intent.value, needs_agent
             )
             
             return intent, needs_agent
         except Exception as e:
-            logger.error(f"Error classifying intent: {str(e)}")
+            logger.error("Error classifying intent: %s", e)
             return IntentType.GENERAL_QUESTION, True
     
     def _select_agents(
         self, 
-        candidates: List[Any], 
+        candidates: Sequence[Any], 
         context: Dict[str, Any]
     ) -> List[Any]:
-        """Select which agent(s) to use from candidates"""
+        """Select which agent(s) to use from candidates.
+        Candidates come from the registry already sorted by priority."""
         if not candidates:
             return []
         
-        if len(candidates) == 1:
-            return [candidates[0].agent_instance]
-        
-        sorted_candidates = sorted(
-            candidates, 
-            key=lambda a: a.priority, 
-            reverse=True
-        )
-        
-        primary = sorted_candidates[0]
+        primary = candidates[0]
         selected = [primary.agent_instance]
         
-        if len(sorted_candidates) > 1:
-            secondary = sorted_candidates[1]
-            if secondary.priority == primary.priority:
-                selected.append(secondary.agent_instance)
+        if len(candidates) > 1 and candidates[1].priority == primary.priority:
+            selected.append(candidates[1].agent_instance)
         
         return selected
     
@@ -141,7 +184,7 @@ class RouterAgent(BaseAgent):
         Provide a natural, friendly response:"""
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            response = await llm_breaker.call(self.llm.ainvoke, [HumanMessage(content=prompt)])
             return {
                 "response": response.content,
                 "agent": self.name,
@@ -163,33 +206,88 @@ class RouterAgent(BaseAgent):
                 }
             }
     
+    async def _run_agent(
+        self,
+        index: int,
+        agent: Any,
+        context: Dict[str, Any]
+    ) -> Tuple[int, Any]:
+        """Run one agent under the shared concurrency limit, returning (index, response or exception)"""
+        async with self._agent_semaphore:
+            try:
+                return index, await agent.process(context)
+            except Exception as e:
+                return index, e
+    
     async def _execute_agents(
         self,
         agents: List[Any],
         context: Dict[str, Any]
     ) -> List[Dict[str, Any]]:
-        """Execute multiple agents in parallel and return their responses"""
-        agent_names = [agent.name for agent in agents]
-        logger.info(f"Executing agents: {agent_names} for message: '{context['message'][:100]}...'")
+        """Execute multiple agents in parallel and return their responses.
+        Stops waiting for the remaining agents once one answers with high confidence."""
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Executing agents: %s for message: '%.100s...'",
+                [agent.name for agent in agents], context['message']
+            )
+        
+        tasks = [
+            asyncio.create_task(self._run_agent(i, agent, context))
+            for i, agent in enumerate(agents)
+        ]
+        responses: Dict[int, Any] = {}
+        early_exit = False
         
-        tasks = [agent.process(context) for agent in agents]
-        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=settings.ROUTER_AGENT_TIMEOUT_SECONDS):
+                index, response = await next_done
+                responses[index] = response
+                if (
+                    not isinstance(response, Exception)
+                    and response.get("metadata", {}).get("confidence", 0) >= settings.ROUTER_EARLY_EXIT_CONFIDENCE
+                ):
+                    early_exit = len(responses) < len(tasks)
+                    break
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Agents timed out after %ss: %s",
+                settings.ROUTER_AGENT_TIMEOUT_SECONDS,
+                [agents[i].name for i in range(len(agents)) if i not in responses]
+            )
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        
+        if early_exit and logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Confident response received, cancelled agents: %s",
+                [agents[i].name for i in range(len(agents)) if i not in responses]
+            )
         
         results = []
-        for i, response in enumerate(responses):
+        for i, agent in enumerate(agents):
+            if i not in responses:
+                if early_exit:
+                    continue
+                responses[i] = asyncio.TimeoutError(
+                    f"no response within {settings.ROUTER_AGENT_TIMEOUT_SECONDS}s"
+                )
+            
+            response = responses[i]
             if isinstance(response, Exception):
-                logger.error(f"Agent {agents[i].name} error: {str(response)}")
+                logger.error("Agent %s error: %s", agent.name, response)
                 results.append({
-                    "response": f"Error from {agents[i].name}: {str(response)}",
-                    "agent": agents[i].name,
+                    "response": f"Error from {agent.name}: {str(response)}",
+                    "agent": agent.name,
                     "metadata": {"error": True}
                 })
             else:
                 agent_response = response.get("response", "")
                 logger.info(
-                    f"Agent {agents[i].name} Response - "
-                    f"Length: {len(agent_response)} chars | "
-                    f"Response: '{agent_response[:200]}...'"
+                    "Agent %s Response - Length: %d chars | Response: '%.200s...'",
+                    agent.name, len(agent_response), agent_response
                 )
                 results.append(response)
         
@@ -200,13 +298,34 @@ class RouterAgent(BaseAgent):
         responses: List[Dict[str, Any]],
         context: Dict[str, Any]
     ) -> str:
-        """Combine multiple agent responses into a single coherent response"""
+        """Combine multiple agent responses into a single coherent response.
+        Only calls the LLM when there are at least two substantive, distinct responses."""
         if len(responses) == 1:
             return responses[0].get("response", "No response generated")
         
+        substantive = [
+            r for r in responses
+            if r.get("response")
+            and not r.get("metadata", {}).get("error")
+            and r.get("metadata", {}).get("confidence", 1.0) > 0.0
+        ]
+        if not substantive:
+            return " / ".join([r.get("response", "") for r in responses])
+        
+        distinct = []
+        for r in substantive:
+            if all(_token_jaccard(r["response"], kept["response"]) < _COMBINE_MAX_SIMILARITY for kept in distinct):
+                distinct.append(r)
+        
+        if len(distinct) == 1:
+            return distinct[0]["response"]
+        
+        if sum(len(r["response"]) for r in distinct) < _COMBINE_MIN_CHARS:
+            return " / ".join([r["response"] for r in distinct])
+        
         agent_responses = "\n\n".join([
             f"Agent {r.get('agent', 'unknown')}: {r.get('response', 'No response')}"
-            for r in responses
+            for r in distinct
         ])
         
         prompt = f"""You are a customer service assistant. 
@@ -221,97 +340,187 @@ class RouterAgent(BaseAgent):
         Provide a unified, natural response that combines the information:"""
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            response = await llm_breaker.call(self.llm.ainvoke, [HumanMessage(content=prompt)])
             return response.content
         except Exception:
-            return " / ".join([r.get("response", "") for r in responses])
+            return " / ".join([r["response"] for r in distinct])
+    
+    async def _resolve_intent(self, context: Dict[str, Any]) -> Tuple[IntentType, bool]:
+        """Reuse the previous decision for a repeated message, otherwise classify it.
+        Greetings need no speculation: the local classifier answers them without an LLM call.
+        Returns (intent, needs_agent)"""
+        decision = self._cached_decision(context["message"])
+        if decision is not None:
+            return decision
+        return await self._classify_intent(context["message"])
+    
+    async def _route(
+        self,
+        context: Dict[str, Any],
+        intent: IntentType,
+        needs_agent: bool,
+        start_ns: int
+    ) -> Dict[str, Any]:
+        """Produce the response for an already classified message"""
+        if not needs_agent:
+            result = await self._handle_direct_response(context)
+            processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+            result["metadata"]["processing_time_ms"] = int(processing_time)
+            
+            logger.info(
+                "Direct Response - Message: '%.100s...' | Response: '%.100s...' | "
+                "Processing Time: %dms",
+                context['message'], result['response'], processing_time
+            )
+            
+            return result
+        
+        candidates = self.registry.find_agents_by_intent(intent)
+        
+        if not candidates:
+            logger.warning(
+                "No agents found for intent: %s | Message: '%.100s...' | "
+                "Falling back to direct response",
+                intent.value, context['message']
+            )
+            result = await self._handle_direct_response(context)
+            processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+
+            result["metadata"]["processing_time_ms"] = int(processing_time)
+            result["metadata"]["note"] = "No specialized agent available, using direct response"
+            return result
+        
+        selected_agents = self._select_agents(candidates, context)
+        
+        if not selected_agents:
+            logger.warning(
+                "No agents selected from candidates | Intent: %s | "
+                "Falling back to direct response",
+                intent.value
+            )
+            result = await self._handle_direct_response(context)
+            processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+            result["metadata"]["processing_time_ms"] = int(processing_time)
+            return result
+        
+        agent_responses = await self._execute_agents(selected_agents, context)
+        combined_response = await self._combine_responses(agent_responses, context)
+        
+        processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+        
+        selected_agent_names = [agent.name for agent in selected_agents]
+        logger.info(
+            "Router Response - Intent: %s | Selected Agents: %s | "
+            "Response Length: %d chars | Processing Time: %dms",
+            intent.value, selected_agent_names, len(combined_response), processing_time
+        )
+        
+        return {
+            "response": combined_response,
+            "agent": self.name,
+            "metadata": {
+                "intent": intent.value,
+                "selected_agents": selected_agent_names,
+                "agent_responses": [r.get("agent") for r in agent_responses],
+                "confidence": 0.9,
+                "processing_time_ms": int(processing_time)
+            }
+        }
+    
+    def _build_error_result(self, context: Dict[str, Any], e: Exception, start_ns: int) -> Dict[str, Any]:
+        """Build the response dict for a failed request"""
+        processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+        logger.error(
+            "Router Error - Message: '%.100s...' | Error: %s | Processing Time: %dms",
+            context.get('message', ''), e, processing_time
+        )
+        return {
+            "response": f"Error processing request: {str(e)} / Erro ao processar solicitação: {str(e)}",
+            "agent": self.name,
+            "metadata": {
+                "confidence": 0.0,
+                "processing_time_ms": int(processing_time),
+                "error": str(e)
+            }
+        }
     
     async def process(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Main processing method - routes to appropriate agent(s)"""
-        from datetime import datetime
-        start_time = datetime.now()
+        start_ns = time.perf_counter_ns()
         
         try:
-            intent, needs_agent = await self._classify_intent(context["message"])
-            
-            if not needs_agent:
-                result = await self._handle_direct_response(context)
-                processing_time = (datetime.now() - start_time).total_seconds() * 1000
-                result["metadata"]["processing_time_ms"] = int(processing_time)
-                
-                logger.info(
-                    f"Direct Response - Message: '{context['message'][:100]}...' | "
-                    f"Response: '{result['response'][:100]}...' | "
-                    f"Processing Time: {int(processing_time)}ms"
-                )
-                
-                return result
-            
-            candidates = self.registry.find_agents_by_intent(intent)
-            
-            if not candidates:
-                logger.warning(
-                    f"No agents found for intent: {intent.value} | "
-                    f"Message: '{context['message'][:100]}...' | "
-                    f"Falling back to direct response"
-                )
-                result = await self._handle_direct_response(context)
-                processing_time = (datetime.now() - start_time).total_seconds() * 1000
-
-                result["metadata"]["processing_time_ms"] = int(processing_time)
-                result["metadata"]["note"] = "No specialized agent available, using direct response"
-                return result
-            
-            selected_agents = self._select_agents(candidates, context)
+            intent, needs_agent = await self._resolve_intent(context)
+            return await self._route(context, intent, needs_agent, start_ns)
+        except Exception as e:
+            return self._build_error_result(context, e, start_ns)
+    
+    async def stream(self, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the response. A single selected agent is streamed through as it
+        generates; direct responses and multi-agent answers are sent as one final frame."""
+        start_ns = time.perf_counter_ns()
+        
+        try:
+            intent, needs_agent = await self._resolve_intent(context)
             
-            if not selected_agents:
-                logger.warning(
-                    f"No agents selected from candidates | "
-                    f"Intent: {intent.value} | "
-                    f"Falling back to direct response"
+            selected_agents = []
+            if needs_agent:
+                selected_agents = self._select_agents(
+                    self.registry.find_agents_by_intent(intent),
+                    context
                 )
-                result = await self._handle_direct_response(context)
-                processing_time = (datetime.now() - start_time).total_seconds() * 1000
-                result["metadata"]["processing_time_ms"] = int(processing_time)
-                return result
-            
-            agent_responses = await self._execute_agents(selected_agents, context)
-            combined_response = await self._combine_responses(agent_responses, context)
             
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
+            if len(selected_agents) != 1:
+                result = await self._route(context, intent, needs_agent, start_ns)
+                yield {**result, "done": True}
+                return
             
-            logger.info(
-                f"Router Response - Intent: {intent.value} | "
-                f"Selected Agents: {[agent.name for agent in selected_agents]} | "
-                f"Response Length: {len(combined_response)} chars | "
-                f"Processing Time: {int(processing_time)}ms"
-            )
-            
-            return {
-                "response": combined_response,
-                "agent": self.name,
-                "metadata": {
-                    "intent": intent.value,
-                    "selected_agents": [agent.name for agent in selected_agents],
-                    "agent_responses": [r.get("agent") for r in agent_responses],
-                    "confidence": 0.9,
-                    "processing_time_ms": int(processing_time)
-                }
-            }
+            agent = selected_agents[0]
+            frames = agent.stream(context).__aiter__()
+            # The concurrency slot and the timeout only cover producing frames,
+            # not the time a slow client takes to read them
+            remaining = settings.ROUTER_AGENT_TIMEOUT_SECONDS
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        async with self._agent_semaphore:
+                            async with asyncio.timeout(remaining):
+                                frame = await frames.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except TimeoutError:
+                        logger.warning(
+                            "Streaming agent %s timed out after %ss",
+                            agent.name, settings.ROUTER_AGENT_TIMEOUT_SECONDS
+                        )
+                        raise asyncio.TimeoutError(
+                            f"no response within {settings.ROUTER_AGENT_TIMEOUT_SECONDS}s"
+                        )
+                    remaining -= time.perf_counter() - started
+                    
+                    if not frame.get("done"):
+                        yield frame
+                        continue
+                    
+                    processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+                    logger.info(
+                        "Router Stream Response - Intent: %s | Selected Agent: %s | "
+                        "Response Length: %d chars | Processing Time: %dms",
+                        intent.value, agent.name, len(frame.get("response", "")), processing_time
+                    )
+                    yield {
+                        "response": frame.get("response", ""),
+                        "agent": self.name,
+                        "metadata": {
+                            "intent": intent.value,
+                            "selected_agents": [agent.name],
+                            "agent_responses": [frame.get("agent")],
+                            "confidence": 0.9,
+                            "processing_time_ms": int(processing_time)
+                        },
+                        "done": True
+                    }
+            finally:
+                await frames.aclose()
         except Exception as e:
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
-            logger.error(
-                f"Router Error - Message: '{context.get('message', '')[:100]}...' | "
-                f"Error: {str(e)} | "
-                f"Processing Time: {int(processing_time)}ms"
-            )
-            return {
-                "response": f"Error processing request: {str(e)} / Erro ao processar solicitação: {str(e)}",
-                "agent": self.name,
-                "metadata": {
-                    "confidence": 0.0,
-                    "processing_time_ms": int(processing_time),
-                    "error": str(e)
-                }
-            }
-
+            yield {**self._build_error_result(context, e, start_ns), "done": True}
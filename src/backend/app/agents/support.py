@@ -1,12 +1,11 @@
-from typing import Dict, Any
-import sys
-from pathlib import Path
-from datetime import datetime
+from typing import Dict, Any, Tuple
+import asyncio
+import time
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, ToolMessage
 
 from app.agents.base import BaseAgent
+from app.core.llm_pool import get_llm, llm_breaker
 from app.models.agent_metadata import IntentType
 from app.tools.support_tools import (
     check_account_status,
@@ -15,12 +14,26 @@ from app.tools.support_tools import (
     check_service_status
 )
 from app.utils.logger import setup_logger
-
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+from app.core.config import settings
 
 logger = setup_logger("support_agent")
 
+# Static part of the system prompt; it must stay byte-identical across requests
+# so the provider's implicit prompt-prefix cache can hit
+_SUPPORT_PREFIX = """You are a helpful customer support agent.
+Always respond in the language used by the user.
+
+You have access to the following tools:
+- check_account_status: Check user account status and balance (requires user_id)
+- get_transaction_history: Get user's transaction history (requires user_id, optional limit)
+- create_support_ticket: Create a support ticket for issues (requires user_id and issue description)
+- check_service_status: Check service status (no parameters)
+
+Use the appropriate tools to help the user. Be empathetic and provide clear next steps.
+After using tools, provide a natural response based on the tool results.
+
+"""
+
 
 class SupportAgent(BaseAgent):
     def __init__(self):
@@ -37,11 +50,7 @@ class SupportAgent(BaseAgent):
             priority=5,
             requires_user_id=True
         )
-        self.llm = ChatGoogleGenerativeAI(
-            model=settings.GEMINI_MODEL,
-            google_api_key=settings.GEMINI_API_KEY,
-            temperature=settings.SUPPORT_TEMPERATURE
-        )
+        self.llm = get_llm(settings.SUPPORT_TEMPERATURE)
         self.tools = [
             check_account_status,
             get_transaction_history,
@@ -49,17 +58,11 @@ class SupportAgent(BaseAgent):
             check_service_status
         ]
         self.llm_with_tools = self.llm.bind_tools(self.tools)
+        self._tool_map = {tool.name: tool for tool in self.tools}
     
     async def _execute_tool(self, tool_name: str, tool_args: Dict[str, Any], user_id: str) -> str:
         """Execute a tool by name and return result as string"""
-        tool_map = {
-            "check_account_status": check_account_status,
-            "get_transaction_history": get_transaction_history,
-            "create_support_ticket": create_support_ticket,
-            "check_service_status": check_service_status
-        }
-        
-        tool = tool_map.get(tool_name)
+        tool = self._tool_map.get(tool_name)
         if not tool:
             return f"Error: Tool {tool_name} not found"
         
@@ -80,9 +83,35 @@ class SupportAgent(BaseAgent):
         except Exception as e:
             return f"Error executing {tool_name}: {str(e)}"
     
+    @staticmethod
+    def _parse_tool_call(tool_call: Any) -> Tuple[str, Dict[str, Any], str]:
+        """Extract (name, args, id) from a tool call given as dict or object"""
+        if isinstance(tool_call, dict):
+            return tool_call.get("name", ""), tool_call.get("args", {}), tool_call.get("id", "")
+        return (
+            getattr(tool_call, "name", ""),
+            getattr(tool_call, "args", {}),
+            getattr(tool_call, "id", "")
+        )
+    
+    async def _run_tool_call(
+        self,
+        tool_name: str,
+        tool_args: Dict[str, Any],
+        tool_call_id: str,
+        user_id: str
+    ) -> ToolMessage:
+        """Execute one tool call and wrap its result in a ToolMessage"""
+        try:
+            content = str(await self._execute_tool(tool_name, tool_args, user_id))
+        except Exception as e:
+            logger.error("Error executing tool %s: %s", tool_name, e)
+            content = f"Error executing {tool_name}: {str(e)}"
+        return ToolMessage(content=content, tool_call_id=tool_call_id, name=tool_name)
+    
     async def process(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Process support requests using tools"""
-        start_time = datetime.now()
+        start_ns = time.perf_counter_ns()
         user_id = context.get("user_id", "")
         message = context.get("message", "")
         
@@ -96,85 +125,49 @@ class SupportAgent(BaseAgent):
                 }
             }
         
-        system_prompt = f"""You are a helpful customer support agent.
-        Always respond in the language used by the user.
-
-        You have access to the following tools:
-        - check_account_status: Check user account status and balance (requires user_id)
-        - get_transaction_history: Get user's transaction history (requires user_id, optional limit)
-        - create_support_ticket: Create a support ticket for issues (requires user_id and issue description)
-        - check_service_status: Check service status (no parameters)
-
-        Current user ID: {user_id}
-        User message: "{message}"
-
-        Use the appropriate tools to help the user. Be empathetic and provide clear next steps.
-        After using tools, provide a natural response based on the tool results."""
+        system_prompt = f'{_SUPPORT_PREFIX}Current user ID: {user_id}\nUser message: "{message}"'
         
         try:
-            from langchain_core.messages import ToolMessage
-            
             messages = [HumanMessage(content=system_prompt)]
             max_iterations = 5
             tools_used = []
             
             for iteration in range(max_iterations):
-                response = await self.llm_with_tools.ainvoke(messages)
+                response = await llm_breaker.call(self.llm_with_tools.ainvoke, messages)
                 messages.append(response)
                 
                 tool_calls = getattr(response, 'tool_calls', []) or []
                 if not tool_calls:
                     break
                 
+                pending_calls = []
                 for tool_call in tool_calls:
-                    if isinstance(tool_call, dict):
-                        tool_name = tool_call.get("name", "")
-                        tool_args = tool_call.get("args", {})
-                        tool_call_id = tool_call.get("id", "")
-                    else:
-                        tool_name = getattr(tool_call, "name", "")
-                        tool_args = getattr(tool_call, "args", {})
-                        tool_call_id = getattr(tool_call, "id", "")
+                    tool_name, tool_args, tool_call_id = self._parse_tool_call(tool_call)
                     
                     if not tool_name:
-                        logger.warning(f"Tool call missing name, skipping: {tool_call}")
+                        logger.warning("Tool call missing name, skipping: %s", tool_call)
                         continue
                     
                     if not tool_call_id:
                         tool_call_id = f"call_{iteration}_{len(tools_used)}"
                     
                     tools_used.append(tool_name)
-                    
-                    try:
-                        tool_result = await self._execute_tool(tool_name, tool_args, user_id)
-                        
-                        messages.append(
-                            ToolMessage(
-                                content=str(tool_result),
-                                tool_call_id=tool_call_id,
-                                name=tool_name
-                            )
-                        )
-                    except Exception as e:
-                        logger.error(f"Error executing tool {tool_name}: {str(e)}")
-                        messages.append(
-                            ToolMessage(
-                                content=f"Error executing {tool_name}: {str(e)}",
-                                tool_call_id=tool_call_id,
-                                name=tool_name
-                            )
-                        )
+                    pending_calls.append((tool_name, tool_args, tool_call_id))
+                
+                tool_messages = await asyncio.gather(*[
+                    self._run_tool_call(tool_name, tool_args, tool_call_id, user_id)
+                    for tool_name, tool_args, tool_call_id in pending_calls
+                ])
+                messages.extend(tool_messages)
             
             final_response = messages[-1].content if messages else "I couldn't process your request."
             
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
+            processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
             
             logger.info(
-                f"Support Agent Response - User ID: {user_id} | "
-                f"Message: '{message[:100]}...' | "
-                f"Tools Used: {tools_used} | "
-                f"Response: '{final_response[:200]}...' | "
-                f"Processing Time: {int(processing_time)}ms"
+                "Support Agent Response - User ID: %s | Message: '%.100s...' | Tools Used: %s | "
+                "Response: '%.200s...' | Processing Time: %dms",
+                user_id, message, tools_used, final_response, processing_time
             )
             
             return {
@@ -187,12 +180,11 @@ class SupportAgent(BaseAgent):
                 }
             }
         except Exception as e:
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
+            processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
             logger.error(
-                f"Support Agent Error - User ID: {user_id} | "
-                f"Message: '{message[:100]}...' | "
-                f"Error: {str(e)} | "
-                f"Processing Time: {int(processing_time)}ms"
+                "Support Agent Error - User ID: %s | Message: '%.100s...' | Error: %s | "
+                "Processing Time: %dms",
+                user_id, message, e, processing_time
             )
             return {
                 "response": f"I encountered an error while processing your request. Please try again. / Encontrei um erro ao processar sua solicitação. Por favor, tente novamente. Error: {str(e)}",
@@ -1,23 +1,75 @@
-from typing import Dict, Any, List, Optional
-import sys
+from typing import Dict, Any, List, Optional, Tuple
+import re
+import time
 import json
+import hashlib
 from pathlib import Path
 from datetime import datetime
 import asyncio
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 
 from app.agents.base import BaseAgent
+from app.core.llm_pool import get_llm, llm_breaker
 from app.models.agent_metadata import IntentType
 from app.core.agent_registry import AgentRegistry
+from app.data.database import db
 from app.utils.logger import setup_logger
-
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+from app.core.config import settings
 
 logger = setup_logger("testing_agent")
 
+_COMPARISON_PREAMBLE = "You are a validation system that compares an actual response from a knowledge agent with an expected answer."
+
+_COMPARISON_CRITERIA = """Analyze and compare these responses. Determine:
+1. Does the actual response contain the key information from the expected answer? (match: true/false)
+2. What is the confidence level? (0.0 to 1.0)
+3. What are the key differences, if any?
+4. What information matches between them?
+5. Is the actual response accurate and complete?
+
+Note: The actual response may be more detailed or phrased differently, but should contain the core information from the expected answer."""
+
+_COMPARISON_FIELDS = (
+    '"match": <true or false>, "confidence": <0.0 to 1.0>, '
+    '"differences": [<key differences, empty if they match>], '
+    '"similarities": [<matching information>], "reason": "<brief explanation>"'
+)
+
+_ITEM_MARKER_RE = re.compile(r"^\s*\[(\d+)\]", re.M)
+
+_FIELD_RE = re.compile(r'^\s*"?(match|confidence|differences|similarities|reason)"?\s*:[ \t]*(.*?),?$', re.I | re.M)
+
+_MATCH_FIELD_RE = re.compile(r'"?match"?\s*:', re.I)
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _load_json(text: str, opener: str) -> Any:
+    """Decode the JSON value starting at the first opener ("{" or "["), ignoring code fences
+    and prose around it; None if there is none or it does not parse"""
+    start = text.find(opener)
+    if start == -1:
+        return None
+    try:
+        return _JSON_DECODER.raw_decode(text, start)[0]
+    except ValueError:
+        return None
+
+
+def _split_list(text: str) -> List[str]:
+    """Split a comma separated field into its non-empty items"""
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+_FIELD_PARSERS = {
+    "match": lambda value: 'true' in value.lower(),
+    "confidence": lambda value: float(value.split()[0]),
+    "differences": lambda value: [] if value.lower() == 'none' else _split_list(value),
+    "similarities": _split_list,
+    "reason": lambda value: value
+}
+
 
 class TestingAgent(BaseAgent):
     def __init__(self):
@@ -29,13 +81,14 @@ class TestingAgent(BaseAgent):
             priority=1,
             requires_user_id=False
         )
-        self.llm = ChatGoogleGenerativeAI(
-            model=settings.GEMINI_MODEL,
-            google_api_key=settings.GEMINI_API_KEY,
-            temperature=settings.TESTING_TEMPERATURE
-        )
+        self.llm = get_llm(settings.TESTING_TEMPERATURE, "application/json")
         self.registry = AgentRegistry()
         self.test_suite = self._load_test_suite()
+        self._test_index = {
+            test_case['question'].lower().strip(): test_case
+            for test_case in self.test_suite
+            if test_case.get('question')
+        }
     
     def _load_test_suite(self) -> List[Dict[str, Any]]:
         """Load test suite from JSON file in utils directory"""
@@ -59,13 +112,7 @@ class TestingAgent(BaseAgent):
     
     def _find_test_case(self, query: str) -> Optional[Dict[str, Any]]:
         """Find a test case by question or return None for custom queries"""
-        query_lower = query.lower().strip()
-        
-        for test_case in self.test_suite:
-            if test_case['question'].lower().strip() == query_lower:
-                return test_case
-        
-        return None
+        return self._test_index.get(query.lower().strip())
     
     async def _get_agent_response(self, query: str) -> Dict[str, Any]:
         """Get response from knowledge agent"""
@@ -97,6 +144,112 @@ class TestingAgent(BaseAgent):
                 "metadata": {"error": str(e)}
             }
     
+    @staticmethod
+    def _comparison_item(question: str, expected_answer: str, actual_response: str, source_url: str) -> str:
+        """Format one question / expected / actual block of a comparison prompt"""
+        return f"""Question: "{question}"
+Source URL: {source_url}
+
+Expected Answer (what the response should contain):
+{expected_answer}
+
+Actual Response (from the knowledge agent):
+{actual_response}"""
+    
+    @staticmethod
+    def _normalize_comparison(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Coerce a JSON verdict into the comparison dict shape"""
+        def as_list(value: Any) -> List[str]:
+            if isinstance(value, str):
+                return [] if value.strip().lower() in ("", "none") else [value.strip()]
+            return [str(v).strip() for v in value or [] if str(v).strip()]
+        
+        match = data.get("match", False)
+        try:
+            confidence = float(data.get("confidence", 0.0))
+        except (TypeError, ValueError):
+            confidence = 0.0
+        return {
+            "match": match if isinstance(match, bool) else str(match).strip().lower() == "true",
+            "confidence": confidence,
+            "reason": str(data.get("reason") or "No reason given"),
+            "differences": as_list(data.get("differences")),
+            "similarities": as_list(data.get("similarities"))
+        }
+    
+    @classmethod
+    def _parse_comparison(cls, response_text: str) -> Optional[Dict[str, Any]]:
+        """Parse a verdict: JSON first, falling back to "field: value" lines.
+        None when the reply holds no match verdict at all."""
+        data = _load_json(response_text, "{")
+        if isinstance(data, dict):
+            return cls._normalize_comparison(data)
+        
+        result = cls._unparsed_comparison()
+        found = False
+        for match in _FIELD_RE.finditer(response_text):
+            field = match.group(1).lower()
+            try:
+                result[field] = _FIELD_PARSERS[field](match.group(2).strip().strip('"'))
+                found = found or field == "match"
+            except (ValueError, IndexError):
+                pass
+        
+        return result if found else None
+    
+    @staticmethod
+    def _unparsed_comparison() -> Dict[str, Any]:
+        """Verdict reported when the comparator's reply cannot be parsed; never cached"""
+        return {
+            "match": False,
+            "confidence": 0.0,
+            "reason": "Could not parse comparison",
+            "differences": [],
+            "similarities": []
+        }
+    
+    @classmethod
+    def _parse_comparison_batch(cls, response_text: str) -> Dict[int, Dict[str, Any]]:
+        """Parse a batch reply into {item number: verdict}: a JSON array first,
+        falling back to "[i]" marked blocks of "field: value" lines"""
+        verdicts: Dict[int, Dict[str, Any]] = {}
+        data = _load_json(response_text, "[")
+        if isinstance(data, list):
+            for entry in data:
+                if isinstance(entry, dict) and isinstance(entry.get("item"), int) and "match" in entry:
+                    verdicts[entry["item"]] = cls._normalize_comparison(entry)
+            return verdicts
+        
+        parts = _ITEM_MARKER_RE.split(response_text)
+        for number, body in zip(parts[1::2], parts[2::2]):
+            verdict = cls._parse_comparison(body.strip()) if _MATCH_FIELD_RE.search(body) else None
+            if verdict is not None:
+                verdicts[int(number)] = verdict
+        return verdicts
+    
+    @staticmethod
+    def _comparison_key(question: str, expected_answer: str, actual_response: str) -> str:
+        """Content hash identifying a comparison in the comparison cache"""
+        payload = f"{settings.GEMINI_MODEL}\x00{question}\x00{expected_answer}\x00{actual_response}"
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+    
+    async def _load_comparisons(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get cached verdicts; a cache failure only means the comparisons are redone"""
+        try:
+            return await db.get_cached_comparisons(keys, settings.TESTING_COMPARISON_CACHE_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Comparison cache lookup failed: {str(e)}")
+            return {}
+    
+    async def _save_comparisons(self, verdicts: Dict[str, Dict[str, Any]]):
+        """Store verdicts in the comparison cache"""
+        if not verdicts:
+            return
+        try:
+            await db.save_comparisons(verdicts)
+        except Exception as e:
+            logger.warning(f"Comparison cache write failed: {str(e)}")
+    
     async def _compare_responses(
         self,
         actual_response: str,
@@ -104,67 +257,25 @@ class TestingAgent(BaseAgent):
         question: str,
         source_url: str
     ) -> Dict[str, Any]:
-        """Compare actual agent response with expected answer using LLM"""
-        prompt = f"""You are a validation system that compares an actual response from a knowledge agent with an expected answer.
-
-Question: "{question}"
-Source URL: {source_url}
-
-Expected Answer (what the response should contain):
-{expected_answer}
-
-Actual Response (from the knowledge agent):
-{actual_response}
+        """Compare actual agent response with expected answer using LLM, reusing cached verdicts"""
+        key = self._comparison_key(question, expected_answer, actual_response)
+        cached = await self._load_comparisons([key])
+        if key in cached:
+            return cached[key]
+        
+        item = self._comparison_item(question, expected_answer, actual_response, source_url)
+        prompt = f"""{_COMPARISON_PREAMBLE}
 
-Analyze and compare these responses. Determine:
-1. Does the actual response contain the key information from the expected answer? (match: true/false)
-2. What is the confidence level? (0.0 to 1.0)
-3. What are the key differences, if any?
-4. What information matches between them?
-5. Is the actual response accurate and complete?
+{item}
 
-Note: The actual response may be more detailed or phrased differently, but should contain the core information from the expected answer.
+{_COMPARISON_CRITERIA}
 
-Respond in this format:
-match: <true or false>
-confidence: <0.0 to 1.0>
-differences: <list of key differences, or "none" if they match>
-similarities: <list of matching information>
-reason: <brief explanation>"""
+Respond ONLY with a JSON object:
+{{{_COMPARISON_FIELDS}}}"""
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            response_text = response.content.strip()
-            
-            result = {
-                "match": False,
-                "confidence": 0.0,
-                "reason": "Could not parse comparison",
-                "differences": [],
-                "similarities": []
-            }
-            
-            for line in response_text.split('\n'):
-                line_lower = line.lower().strip()
-                if 'match:' in line_lower:
-                    result["match"] = 'true' in line_lower
-                elif 'confidence:' in line_lower:
-                    try:
-                        conf_str = line.split('confidence:')[1].strip()
-                        result["confidence"] = float(conf_str.split()[0])
-                    except:
-                        pass
-                elif 'differences:' in line_lower:
-                    diff_text = line.split('differences:')[1].strip()
-                    if diff_text.lower() != 'none':
-                        result["differences"] = [d.strip() for d in diff_text.split(',') if d.strip()]
-                elif 'similarities:' in line_lower:
-                    sim_text = line.split('similarities:')[1].strip()
-                    result["similarities"] = [s.strip() for s in sim_text.split(',') if s.strip()]
-                elif 'reason:' in line_lower:
-                    result["reason"] = line.split('reason:')[1].strip()
-            
-            return result
+            response = await llm_breaker.call(self.llm.ainvoke, [HumanMessage(content=prompt)])
+            result = self._parse_comparison(response.content.strip())
         except Exception as e:
             logger.error(f"Error comparing responses: {str(e)}")
             return {
@@ -174,78 +285,203 @@ reason: <brief explanation>"""
                 "differences": [],
                 "similarities": []
             }
+        
+        if result is None:
+            logger.warning("Could not parse comparison reply; verdict not cached")
+            return self._unparsed_comparison()
+        
+        await self._save_comparisons({key: result})
+        return result
+    
+    async def _compare_responses_batch(
+        self,
+        items: List[Tuple[str, str, str, str]]
+    ) -> List[Dict[str, Any]]:
+        """Compare several (question, expected_answer, actual_response, source_url) items in one LLM call.
+        Cached verdicts are reused; items whose verdict is missing from the reply are compared one by one."""
+        keys = [self._comparison_key(question, expected, actual) for question, expected, actual, _ in items]
+        verdicts: Dict[int, Dict[str, Any]] = {}
+        cached = await self._load_comparisons(keys)
+        for index, key in enumerate(keys):
+            if key in cached:
+                verdicts[index] = cached[key]
+        
+        pending = [index for index in range(len(items)) if index not in verdicts]
+        if len(pending) > 1:
+            blocks = "\n\n".join(
+                f"[{number}]\n{self._comparison_item(*items[index])}"
+                for number, index in enumerate(pending, 1)
+            )
+            prompt = f"""{_COMPARISON_PREAMBLE}
+There are {len(pending)} numbered items below; compare each one independently.
+
+{blocks}
+
+{_COMPARISON_CRITERIA}
+
+Respond ONLY with a JSON array holding one object per item, each with its item number:
+[{{"item": 1, {_COMPARISON_FIELDS}}}, {{"item": 2, ...}}]"""
+            
+            try:
+                response = await llm_breaker.call(self.llm.ainvoke, [HumanMessage(content=prompt)])
+                parsed = self._parse_comparison_batch(response.content)
+                fresh = {
+                    pending[number - 1]: verdict for number, verdict in parsed.items()
+                    if 1 <= number <= len(pending)
+                }
+                verdicts.update(fresh)
+                await self._save_comparisons({keys[index]: verdict for index, verdict in fresh.items()})
+            except Exception as e:
+                logger.error(f"Error comparing response batch: {str(e)}")
+        
+        missing = [index for index in range(len(items)) if index not in verdicts]
+        if missing:
+            if len(pending) > 1:
+                logger.warning(f"Batch comparison returned {len(pending) - len(missing)}/{len(pending)} verdicts, comparing the rest individually")
+            fallbacks = await asyncio.gather(*[
+                self._compare_responses(items[index][2], items[index][1], items[index][0], items[index][3])
+                for index in missing
+            ])
+            verdicts.update(zip(missing, fallbacks))
+        
+        return [verdicts[index] for index in range(len(items))]
+    
+    def _build_test_result(
+        self,
+        test_case: Dict[str, Any],
+        agent_result: Dict[str, Any],
+        comparison: Dict[str, Any],
+        processing_time: int
+    ) -> Dict[str, Any]:
+        """Build the result dict of a compared test case"""
+        test_id = test_case.get('id', 'unknown')
+        status = "PASS" if comparison["match"] and comparison["confidence"] > 0.7 else "FAIL"
+        
+        logger.info(
+            f"Test {test_id} Result - Status: {status} | "
+            f"Confidence: {comparison['confidence']:.2f} | "
+            f"Processing Time: {int(processing_time)}ms"
+        )
+        
+        return {
+            "test_id": test_id,
+            "question": test_case.get('question', ''),
+            "source_url": test_case.get('source_url', ''),
+            "status": status,
+            "confidence": comparison["confidence"],
+            "match": comparison["match"],
+            "expected_answer": test_case.get('expected_answer', ''),
+            "actual_response": agent_result.get("response", ""),
+            "agent_metadata": agent_result.get("metadata", {}),
+            "comparison": comparison,
+            "processing_time_ms": int(processing_time)
+        }
     
     async def _run_single_test(self, test_case: Dict[str, Any]) -> Dict[str, Any]:
         """Run a single test case"""
         test_id = test_case.get('id', 'unknown')
         question = test_case.get('question', '')
-        expected_answer = test_case.get('expected_answer', '')
-        source_url = test_case.get('source_url', '')
         
         logger.info(f"Running test {test_id}: '{question[:100]}...'")
         
-        start_time = datetime.now()
+        start_ns = time.perf_counter_ns()
         
         try:
             agent_result = await self._get_agent_response(question)
-            actual_response = agent_result.get("response", "")
-            agent_metadata = agent_result.get("metadata", {})
-            
             comparison = await self._compare_responses(
-                actual_response,
-                expected_answer,
+                agent_result.get("response", ""),
+                test_case.get('expected_answer', ''),
                 question,
-                source_url
+                test_case.get('source_url', '')
             )
-            
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
-            status = "PASS" if comparison["match"] and comparison["confidence"] > 0.7 else "FAIL"
-            
-            logger.info(
-                f"Test {test_id} Result - Status: {status} | "
-                f"Confidence: {comparison['confidence']:.2f} | "
-                f"Processing Time: {int(processing_time)}ms"
-            )
-            
-            return {
-                "test_id": test_id,
-                "question": question,
-                "source_url": source_url,
-                "status": status,
-                "confidence": comparison["confidence"],
-                "match": comparison["match"],
-                "expected_answer": expected_answer,
-                "actual_response": actual_response,
-                "agent_metadata": agent_metadata,
-                "comparison": comparison,
-                "processing_time_ms": int(processing_time)
-            }
+            processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+            return self._build_test_result(test_case, agent_result, comparison, processing_time)
         except Exception as e:
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
-            logger.error(f"Test {test_id} Error: {str(e)}")
-            return {
-                "test_id": test_id,
-                "question": question,
-                "source_url": source_url,
-                "status": "ERROR",
-                "confidence": 0.0,
-                "match": False,
-                "error": str(e),
-                "processing_time_ms": int(processing_time)
-            }
+            processing_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+            return self._error_result(test_case, e, processing_time)
+    
+    def _error_result(self, test_case: Dict[str, Any], error: Exception, processing_time: int) -> Dict[str, Any]:
+        """Build the ERROR result for a test case that raised"""
+        test_id = test_case.get('id', 'unknown')
+        logger.error(f"Test {test_id} Error: {str(error)}")
+        return {
+            "test_id": test_id,
+            "question": test_case.get('question', ''),
+            "source_url": test_case.get('source_url', ''),
+            "status": "ERROR",
+            "confidence": 0.0,
+            "match": False,
+            "error": str(error),
+            "processing_time_ms": int(processing_time)
+        }
     
     async def _run_all_tests(self) -> Dict[str, Any]:
-        """Run all test cases in the suite"""
+        """Run all test cases in the suite as a two-stage pipeline: knowledge agent responses
+        are fetched concurrently (TESTING_MAX_CONCURRENT) and every TESTING_COMPARE_BATCH_SIZE
+        responses are handed to a batch comparison (TESTING_LLM_CONCURRENCY) while fetching continues"""
         logger.info(f"Running all {len(self.test_suite)} test cases")
         
-        start_time = datetime.now()
-        results = []
+        start_ns = time.perf_counter_ns()
+        agent_semaphore = asyncio.Semaphore(settings.TESTING_MAX_CONCURRENT)
+        llm_semaphore = asyncio.Semaphore(settings.TESTING_LLM_CONCURRENCY)
+        test_cases = self.test_suite
+        fetch_times = [0] * len(test_cases)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(test_cases)
         
-        for test_case in self.test_suite:
-            result = await self._run_single_test(test_case)
-            results.append(result)
+        async def fetch(index: int, test_case: Dict[str, Any]) -> Tuple[int, Any]:
+            async with agent_semaphore:
+                fetch_start_ns = time.perf_counter_ns()
+                logger.info(f"Running test {test_case.get('id', 'unknown')}: '{test_case.get('question', '')[:100]}...'")
+                try:
+                    agent_result = await self._get_agent_response(test_case.get('question', ''))
+                except Exception as e:
+                    agent_result = e
+                fetch_times[index] = (time.perf_counter_ns() - fetch_start_ns) // 1_000_000
+                return index, agent_result
+        
+        async def compare(batch: List[Tuple[int, Dict[str, Any]]]):
+            async with llm_semaphore:
+                compare_start_ns = time.perf_counter_ns()
+                try:
+                    comparisons = await self._compare_responses_batch([
+                        (
+                            test_cases[i].get('question', ''),
+                            test_cases[i].get('expected_answer', ''),
+                            agent_result.get("response", ""),
+                            test_cases[i].get('source_url', '')
+                        )
+                        for i, agent_result in batch
+                    ])
+                except Exception as e:
+                    for i, _ in batch:
+                        results[i] = self._error_result(test_cases[i], e, fetch_times[i])
+                    return
+                compare_time = (time.perf_counter_ns() - compare_start_ns) // 1_000_000
+            
+            for (i, agent_result), comparison in zip(batch, comparisons):
+                results[i] = self._build_test_result(
+                    test_cases[i], agent_result, comparison, fetch_times[i] + compare_time
+                )
+        
+        batch_size = settings.TESTING_COMPARE_BATCH_SIZE
+        pending: List[Tuple[int, Dict[str, Any]]] = []
+        compare_tasks = []
+        
+        for fetched in asyncio.as_completed([fetch(i, test_case) for i, test_case in enumerate(test_cases)]):
+            i, agent_result = await fetched
+            if isinstance(agent_result, Exception):
+                results[i] = self._error_result(test_cases[i], agent_result, fetch_times[i])
+                continue
+            pending.append((i, agent_result))
+            if len(pending) >= batch_size:
+                compare_tasks.append(asyncio.create_task(compare(pending)))
+                pending = []
+        
+        if pending:
+            compare_tasks.append(asyncio.create_task(compare(pending)))
+        await asyncio.gather(*compare_tasks)
         
-        total_time = (datetime.now() - start_time).total_seconds() * 1000
+        total_time = (time.perf_counter_ns() - start_ns) // 1_000_000
         
         passed = sum(1 for r in results if r.get("status") == "PASS")
         failed = sum(1 for r in results if r.get("status") == "FAIL")
@@ -283,7 +519,7 @@ reason: <brief explanation>"""
         if message.lower() == "run_all" or message.lower() == "run all":
             suite_results = await self._run_all_tests()
             
-            summary = f"""Test Suite Results:
+            parts = [f"""Test Suite Results:
 
 Total Tests: {suite_results['total_tests']}
 Passed: {suite_results['passed']}
@@ -293,15 +529,15 @@ Pass Rate: {suite_results['pass_rate']:.1%}
 Total Time: {suite_results['total_time_ms']}ms
 
 Detailed Results:
-"""
+"""]
             for result in suite_results['results']:
-                summary += f"\n{result['test_id']}: {result['status']} (Confidence: {result.get('confidence', 0):.2f})\n"
-                summary += f"  Question: {result['question']}\n"
+                parts.append(f"\n{result['test_id']}: {result['status']} (Confidence: {result.get('confidence', 0):.2f})\n")
+                parts.append(f"  Question: {result['question']}\n")
                 if result.get('error'):
-                    summary += f"  Error: {result['error']}\n"
+                    parts.append(f"  Error: {result['error']}\n")
             
             return {
-                "response": summary,
+                "response": "".join(parts),
                 "agent": self.name,
                 "metadata": suite_results
             }
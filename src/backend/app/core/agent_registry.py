@@ -1,37 +1,72 @@
-from typing import Dict, List, Optional
+from operator import attrgetter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from app.models.agent_metadata import AgentMetadata, IntentType
 
 
 class AgentRegistry:
     _instance = None
-    _agents: Dict[str, AgentMetadata] = {}
+    _agents: Dict[str, AgentMetadata]
+    _by_intent: Dict[IntentType, Tuple[AgentMetadata, ...]]
+    _by_capability: Dict[str, Tuple[AgentMetadata, ...]]
+    _intent_desc_cache: Optional[Dict[str, str]]
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
+            instance = super().__new__(cls)
+            instance._agents = {}
+            instance._by_intent = {}
+            instance._by_capability = {}
+            instance._intent_desc_cache = None
+            cls._instance = instance
         return cls._instance
     
+    @staticmethod
+    def _reindex(
+        index: Dict[Any, Tuple[AgentMetadata, ...]],
+        keys: Iterable[Any],
+        previous_keys: Iterable[Any],
+        metadata: AgentMetadata,
+        by_priority: bool
+    ):
+        """Replace metadata's entry under every key it (or its previous registration) is indexed by"""
+        keys = set(keys)
+        for key in keys.union(previous_keys):
+            agents = [agent for agent in index.get(key, ()) if agent.name != metadata.name]
+            if key in keys:
+                agents.append(metadata)
+            if by_priority:
+                agents.sort(key=attrgetter('priority'), reverse=True)
+            if agents:
+                index[key] = tuple(agents)
+            else:
+                index.pop(key, None)
+    
     def register(self, metadata: AgentMetadata):
-        """Register an agent"""
+        """Register an agent and index it by intent (highest priority first) and by capability"""
+        previous = self._agents.get(metadata.name)
         self._agents[metadata.name] = metadata
+        
+        self._reindex(
+            self._by_intent, metadata.intents,
+            previous.intents if previous else (), metadata, by_priority=True
+        )
+        self._reindex(
+            self._by_capability, metadata.capabilities,
+            previous.capabilities if previous else (), metadata, by_priority=False
+        )
+        self._intent_desc_cache = None
     
     def get_agent(self, name: str) -> Optional[AgentMetadata]:
         """Get agent by name"""
         return self._agents.get(name)
     
-    def find_agents_by_intent(self, intent: IntentType) -> List[AgentMetadata]:
-        """Find all agents that handle this intent"""
-        return [
-            agent for agent in self._agents.values()
-            if intent in agent.intents
-        ]
+    def find_agents_by_intent(self, intent: IntentType) -> Tuple[AgentMetadata, ...]:
+        """Find all agents that handle this intent, sorted by priority (highest first)"""
+        return self._by_intent.get(intent, ())
     
     def find_agents_by_capability(self, capability: str) -> List[AgentMetadata]:
         """Find agents with specific capability"""
-        return [
-            agent for agent in self._agents.values()
-            if capability in agent.capabilities
-        ]
+        return list(self._by_capability.get(capability, ()))
     
     def get_all_agents(self) -> List[AgentMetadata]:
         """Get all registered agents"""
@@ -40,28 +75,25 @@ class AgentRegistry:
     def select_best_agent(self, intent: IntentType) -> Optional[AgentMetadata]:
         """Select best agent for intent (highest priority)"""
         candidates = self.find_agents_by_intent(intent)
-        if not candidates:
-            return None
-        return max(candidates, key=lambda a: a.priority)
+        return candidates[0] if candidates else None
     
     def get_available_intents(self) -> Dict[IntentType, List[AgentMetadata]]:
         """Get all intents that have registered agents, grouped by intent"""
-        intent_map: Dict[IntentType, List[AgentMetadata]] = {}
-        for agent in self._agents.values():
-            for intent in agent.intents:
-                if intent not in intent_map:
-                    intent_map[intent] = []
-                intent_map[intent].append(agent)
-        return intent_map
+        return {intent: list(agents) for intent, agents in self._by_intent.items()}
     
     def get_intent_descriptions(self) -> Dict[str, str]:
-        """Get descriptions of what each intent handles, based on registered agents"""
+        """Get descriptions of what each intent handles, based on registered agents.
+        Cached until the next register()."""
+        if self._intent_desc_cache is None:
+            self._intent_desc_cache = self._compute_intent_descriptions()
+        return self._intent_desc_cache
+    
+    def _compute_intent_descriptions(self) -> Dict[str, str]:
+        """Build the intent descriptions from the intent index"""
         intent_descriptions = {}
-        intent_map = self.get_available_intents()
-        
-        for intent, agents in intent_map.items():
-            descriptions = [agent.description for agent in agents]
-            intent_descriptions[intent.value] = f"Handled by: {', '.join(set(descriptions))}"
+        for intent, agents in self._by_intent.items():
+            descriptions = dict.fromkeys(agent.description for agent in agents)
+            intent_descriptions[intent.value] = f"Handled by: {', '.join(descriptions)}"
         
         return intent_descriptions
 
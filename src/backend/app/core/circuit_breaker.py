@@ -0,0 +1,114 @@
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+from app.utils.logger import setup_logger
+
+logger = setup_logger("circuit_breaker")
+
+_breakers: Dict[str, "CircuitBreaker"] = {}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the circuit is open"""
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Check if an error comes from provider rate limiting / quota exhaustion"""
+    error_str = str(error).lower()
+    return "429" in error_str or "quota" in error_str or "resource_exhausted" in error_str
+
+
+def breaker_states() -> Dict[str, str]:
+    """Get the current state of every circuit breaker"""
+    return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+class CircuitBreaker:
+    """Stops calling a provider for reset_timeout seconds after fail_max consecutive quota errors.
+    After the timeout a single trial call is let through (half-open); its outcome closes or reopens the circuit."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        fail_max: int = 5,
+        reset_timeout: float = 30.0,
+        is_failure: Callable[[Exception], bool] = is_quota_error
+    ):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = self.CLOSED
+        self._trial_in_flight = False
+        _breakers[name] = self
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def _set_state(self, state: str):
+        if state != self._state:
+            logger.warning("Circuit %s state: %s -> %s", self.name, self._state, state)
+            self._state = state
+
+    def _before_call(self) -> bool:
+        """Raise if the call must be rejected; returns True if this call is the half-open trial"""
+        state = self.state
+        if state == self.CLOSED:
+            return False
+        if state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        raise CircuitOpenError(
+            f"Circuit {self.name} is open after repeated quota errors; "
+            f"retrying in {max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)):.0f}s"
+        )
+
+    def _after_failure(self, error: Exception, trial: bool):
+        if self.is_failure(error):
+            self._failures += 1
+            if trial or self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+        elif trial:
+            self._set_state(self.CLOSED)
+
+    def _after_success(self):
+        self._failures = 0
+        self._set_state(self.CLOSED)
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Await func(*args, **kwargs) through the breaker"""
+        trial = self._before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self._after_failure(e, trial)
+            raise
+        finally:
+            if trial:
+                self._trial_in_flight = False
+        self._after_success()
+        return result
+
+    async def stream(self, func: Callable[..., AsyncIterator[Any]], *args, **kwargs) -> AsyncIterator[Any]:
+        """Iterate func(*args, **kwargs) through the breaker"""
+        trial = self._before_call()
+        try:
+            async for item in func(*args, **kwargs):
+                yield item
+        except Exception as e:
+            self._after_failure(e, trial)
+            raise
+        finally:
+            if trial:
+                self._trial_in_flight = False
+        self._after_success()
@@ -0,0 +1,82 @@
+from pydantic_settings import BaseSettings
+from typing import List
+from pathlib import Path
+
+
+def find_env_file():
+    """Find .env file in project root"""
+    import os
+    if os.getenv('DOCKER_ENV') or os.path.exists('/app/data'):
+        env_file = Path('/app/.env')
+        if env_file.exists():
+            return str(env_file)
+        return ".env"
+    
+    current_file = Path(__file__).resolve()
+    project_root = current_file.parents[4]
+    env_file = project_root / ".env"
+    
+    if env_file.exists():
+        return str(env_file)
+    
+    env_file_local = current_file.parents[2] / ".env"
+    if env_file_local.exists():
+        return str(env_file_local)
+    
+    return ".env"
+
+
+class Settings(BaseSettings):
+    GEMINI_API_KEY: str
+    GEMINI_MODEL: str = "gemini-2.5-flash"
+    GEMINI_EMBEDDING_MODEL: str = "models/embedding-001"
+    EMBEDDING_BATCH_SIZE: int = 100
+    EMBEDDING_MAX_CONCURRENT: int = 8
+    EMBEDDING_CACHE_SIZE: int = 4096
+    INGESTION_EMBED_CONCURRENCY: int = 4
+    EMBEDDING_RPM: float = 1500
+    LLM_BREAKER_FAIL_MAX: int = 5
+    LLM_BREAKER_RESET_SECONDS: float = 30.0
+    
+    CHUNK_SIZE: int = 500
+    CHUNK_OVERLAP: int = 50
+    RETRIEVAL_TOP_K: int = 5
+    RETRIEVAL_CACHE_SIZE: int = 2048
+    RETRIEVAL_CACHE_TTL_SECONDS: int = 300
+    RETRIEVAL_CACHE_FUZZY_ENABLED: bool = True
+    RETRIEVAL_CACHE_FUZZY_MAX_DISTANCE: int = 3
+    # A SimHash near-match is only served if the query embeddings are this close
+    RETRIEVAL_CACHE_FUZZY_MIN_COSINE: float = 0.97
+    
+    SCRAPE_URLS: List[str] = [
+        "INSIRA_SUAS_ROTAS_AQUI",
+        "https://example.com/page1",
+        "https://example.com/page2"
+    ]
+    
+    ENABLE_PASSIVE_TESTING: bool = True
+    ROUTER_TEMPERATURE: float = 0.3
+    ROUTER_DECISION_CACHE_SIZE: int = 512
+    # Calibrated for Gemini embeddings, whose cosines between unrelated texts sit around 0.5-0.6
+    INTENT_MIN_SIMILARITY: float = 0.65
+    INTENT_MIN_MARGIN: float = 0.05
+    ROUTER_MAX_CONCURRENT_AGENTS: int = 8
+    # Backstop for hung agents, sized for the support agent's tool loop (up to 5 LLM calls plus tools)
+    ROUTER_AGENT_TIMEOUT_SECONDS: float = 90.0
+    # Agents report at most 0.9 (knowledge with sources, support after using tools)
+    ROUTER_EARLY_EXIT_CONFIDENCE: float = 0.9
+    KNOWLEDGE_TEMPERATURE: float = 0.7
+    SUPPORT_TEMPERATURE: float = 0.5
+    TESTING_TEMPERATURE: float = 0.4
+    TESTING_MAX_CONCURRENT: int = 8
+    TESTING_COMPARE_BATCH_SIZE: int = 8
+    TESTING_LLM_CONCURRENCY: int = 4
+    TESTING_COMPARISON_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    
+    class Config:
+        env_file = find_env_file()
+        case_sensitive = True
+
+
+settings = Settings()
+
@@ -0,0 +1,32 @@
+from functools import lru_cache
+from typing import Optional, Union
+
+from langchain_core.runnables import Runnable
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.config import settings
+
+llm_breaker = CircuitBreaker(
+    "gemini_llm",
+    fail_max=settings.LLM_BREAKER_FAIL_MAX,
+    reset_timeout=settings.LLM_BREAKER_RESET_SECONDS
+)
+
+
+@lru_cache(maxsize=8)
+def get_llm(
+    temperature: float,
+    response_mime_type: Optional[str] = None
+) -> Union[ChatGoogleGenerativeAI, Runnable]:
+    """Get the shared Gemini chat client for a temperature (and optional response MIME type).
+    Agents using the same settings share one client and its connection pool."""
+    if response_mime_type:
+        # The pinned langchain-google-genai has no response_mime_type field; it is passed
+        # per call through generation_config, on top of the plain client for this temperature
+        return get_llm(temperature).bind(generation_config={"response_mime_type": response_mime_type})
+    return ChatGoogleGenerativeAI(
+        model=settings.GEMINI_MODEL,
+        google_api_key=settings.GEMINI_API_KEY,
+        temperature=temperature
+    )
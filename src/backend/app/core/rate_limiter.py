@@ -0,0 +1,59 @@
+import asyncio
+import time
+from typing import Optional
+
+from app.utils.logger import setup_logger
+
+logger = setup_logger("rate_limiter")
+
+
+class TokenBucket:
+    """Token bucket refilled at rpm / 60 tokens per second.
+    The rate follows AIMD: halved on a rate-limit error, raised by a tenth of the
+    ceiling after every recover_after consecutive successes."""
+
+    def __init__(
+        self,
+        rpm: float,
+        burst: Optional[float] = None,
+        min_rpm: float = 1.0,
+        recover_after: int = 10
+    ):
+        self.max_rpm = rpm
+        self.rpm = rpm
+        self.min_rpm = min_rpm
+        self.capacity = burst if burst is not None else max(1.0, rpm / 60)
+        self.recover_after = recover_after
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._successes = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rpm / 60)
+        self._updated_at = now
+
+    async def acquire(self):
+        """Wait until a request may be sent; waiters are served in arrival order"""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) * 60 / self.rpm)
+                self._refill()
+            self._tokens -= 1
+
+    def on_success(self):
+        """Additive increase after enough consecutive successes"""
+        self._successes += 1
+        if self._successes >= self.recover_after and self.rpm < self.max_rpm:
+            self._successes = 0
+            self.rpm = min(self.max_rpm, self.rpm + self.max_rpm / 10)
+            logger.info("Rate raised to %.0f rpm", self.rpm)
+
+    def on_rate_limited(self):
+        """Multiplicative decrease after a rate-limit error"""
+        self._successes = 0
+        self.rpm = max(self.min_rpm, self.rpm / 2)
+        self._tokens = min(self._tokens, 0.0)
+        logger.warning("Rate limited, lowering rate to %.0f rpm", self.rpm)
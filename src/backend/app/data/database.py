@@ -1,16 +1,18 @@
+import asyncio
+import json
 import aiosqlite
-from typing import Optional, List, Dict, Any
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, AsyncIterator
 from datetime import datetime
 from pathlib import Path
-import sys
 
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+from app.core.config import settings
 
 
 class Database:
     _instance = None
     _db_path: Optional[str] = None
+    _conn: Optional[aiosqlite.Connection] = None
     
     def __new__(cls):
         if cls._instance is None:
@@ -29,11 +31,54 @@ class Database:
                 data_dir = project_root / "data"
             data_dir.mkdir(exist_ok=True)
             self._db_path = str(data_dir / "users.db")
+            self._write_lock = asyncio.Lock()
+            self._connect_lock = asyncio.Lock()
             self._initialized = True
     
+    async def _connection(self) -> aiosqlite.Connection:
+        """Get the shared connection, opening it on first use"""
+        if self._conn is None:
+            async with self._connect_lock:
+                if self._conn is None:
+                    conn = await aiosqlite.connect(self._db_path)
+                    conn.row_factory = aiosqlite.Row
+                    await conn.execute("PRAGMA journal_mode=WAL")
+                    await conn.execute("PRAGMA synchronous=NORMAL")
+                    await conn.execute("PRAGMA temp_store=MEMORY")
+                    await conn.execute("PRAGMA mmap_size=268435456")
+                    self._conn = conn
+        return self._conn
+    
+    async def close(self):
+        """Close the shared connection"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
+    
+    @asynccontextmanager
+    async def transaction(self, durable: bool = True) -> AsyncIterator[aiosqlite.Connection]:
+        """Run a block of writes on the shared connection in one immediate transaction.
+        durable=False skips fsync for the block; only for data a re-run can rebuild, like seeds."""
+        db = await self._connection()
+        async with self._write_lock:
+            if not durable:
+                await db.execute("PRAGMA synchronous=OFF")
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                try:
+                    yield db
+                except BaseException:
+                    await db.rollback()
+                    raise
+                await db.commit()
+            finally:
+                if not durable:
+                    await db.execute("PRAGMA synchronous=NORMAL")
+    
     async def initialize(self):
-        """Create tables if they don't exist"""
-        async with aiosqlite.connect(self._db_path) as db:
+        """Open the shared connection and create tables if they don't exist"""
+        db = await self._connection()
+        async with self._write_lock:
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     user_id TEXT PRIMARY KEY,
@@ -68,19 +113,33 @@ class Database:
                 )
             """)
             
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS comparison_cache (
+                    hash TEXT PRIMARY KEY,
+                    result_json TEXT NOT NULL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tx_user_created ON transactions(user_id, created_at DESC)"
+            )
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_user ON support_tickets(user_id)"
+            )
+            
             await db.commit()
     
     async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
-        async with aiosqlite.connect(self._db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM users WHERE user_id = ?", (user_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return dict(row)
-                return None
+        db = await self._connection()
+        async with db.execute(
+            "SELECT * FROM users WHERE user_id = ?", (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return dict(row)
+            return None
     
     async def get_user_transactions(
         self, 
@@ -88,17 +147,16 @@ class Database:
         limit: int = 10
     ) -> List[Dict[str, Any]]:
         """Get user transactions"""
-        async with aiosqlite.connect(self._db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                """SELECT * FROM transactions 
-                   WHERE user_id = ? 
-                   ORDER BY created_at DESC 
-                   LIMIT ?""",
-                (user_id, limit)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        db = await self._connection()
+        async with db.execute(
+            """SELECT * FROM transactions 
+               WHERE user_id = ? 
+               ORDER BY created_at DESC 
+               LIMIT ?""",
+            (user_id, limit)
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
     
     async def create_support_ticket(
         self, 
@@ -109,13 +167,19 @@ class Database:
         import uuid
         ticket_id = str(uuid.uuid4())
         
-        async with aiosqlite.connect(self._db_path) as db:
-            await db.execute(
-                """INSERT INTO support_tickets (ticket_id, user_id, issue)
-                   VALUES (?, ?, ?)""",
-                (ticket_id, user_id, issue)
-            )
-            await db.commit()
+        db = await self._connection()
+        async with self._write_lock:
+            try:
+                await db.execute(
+                    """INSERT INTO support_tickets (ticket_id, user_id, issue)
+                       VALUES (?, ?, ?)""",
+                    (ticket_id, user_id, issue)
+                )
+                await db.commit()
+            except Exception:
+                # Don't leave the shared connection inside a failed transaction
+                await db.rollback()
+                raise
         
         return ticket_id
     
@@ -133,25 +197,65 @@ class Database:
         status: str = "active"
     ) -> Dict[str, Any]:
         """Create a new user"""
-        async with aiosqlite.connect(self._db_path) as db_conn:
+        db_conn = await self._connection()
+        async with self._write_lock:
             try:
-                await db_conn.execute(
+                async with db_conn.execute(
                     """INSERT INTO users (user_id, name, email, balance, status)
-                       VALUES (?, ?, ?, ?, ?)""",
+                       VALUES (?, ?, ?, ?, ?)
+                       RETURNING *""",
                     (user_id, name, email, balance, status)
-                )
+                ) as cursor:
+                    row = await cursor.fetchone()
                 await db_conn.commit()
-                return await self.get_user(user_id)
+                return dict(row)
             except aiosqlite.IntegrityError:
+                await db_conn.rollback()
                 raise ValueError(f"User with ID {user_id} already exists")
+            except Exception:
+                await db_conn.rollback()
+                raise
+    
+    async def get_cached_comparisons(
+        self,
+        keys: List[str],
+        max_age_seconds: int
+    ) -> Dict[str, Dict[str, Any]]:
+        """Get cached test comparison verdicts by hash, skipping entries older than max_age_seconds"""
+        if not keys:
+            return {}
+        db = await self._connection()
+        placeholders = ", ".join("?" * len(keys))
+        async with db.execute(
+            f"""SELECT hash, result_json FROM comparison_cache
+                WHERE hash IN ({placeholders})
+                AND created_at >= datetime('now', ?)""",
+            (*keys, f"-{int(max_age_seconds)} seconds")
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return {row["hash"]: json.loads(row["result_json"]) for row in rows}
+    
+    async def save_comparisons(self, verdicts: Dict[str, Dict[str, Any]]):
+        """Store test comparison verdicts by hash"""
+        db = await self._connection()
+        async with self._write_lock:
+            try:
+                await db.executemany(
+                    """INSERT OR REPLACE INTO comparison_cache (hash, result_json, created_at)
+                       VALUES (?, ?, CURRENT_TIMESTAMP)""",
+                    [(key, json.dumps(verdict)) for key, verdict in verdicts.items()]
+                )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
     
     async def list_all_users(self) -> List[Dict[str, Any]]:
         """Get all users"""
-        async with aiosqlite.connect(self._db_path) as db_conn:
-            db_conn.row_factory = aiosqlite.Row
-            async with db_conn.execute("SELECT * FROM users") as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        db_conn = await self._connection()
+        async with db_conn.execute("SELECT * FROM users") as cursor:
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
 
 
 db = Database()
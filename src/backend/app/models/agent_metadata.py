@@ -11,6 +11,8 @@ class IntentType(str, Enum):
 
 
 class AgentMetadata(BaseModel):
+    model_config = {'frozen': True}
+    
     name: str
     description: str
     intents: List[IntentType]
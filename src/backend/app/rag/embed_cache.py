@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a query so trivially different spellings share a cache entry"""
+    return unicodedata.normalize("NFKC", text).strip().casefold()
+
+
+def _shingles(normalized: str, size: int = 3) -> List[str]:
+    """Split a normalized query into overlapping token shingles"""
+    tokens = normalized.split()
+    if len(tokens) <= size:
+        return tokens or [normalized]
+    return [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+
+def simhash(normalized: str) -> int:
+    """64-bit SimHash signature over the token shingles of a normalized query"""
+    weights = [0] * 64
+    for shingle in _shingles(normalized):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    signature = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            signature |= 1 << bit
+    return signature
+
+
+class AsyncLRUCache:
+    """In-memory LRU cache with TTL for async computations keyed by query text.
+    With fuzzy_max_distance and embed set, a query whose SimHash is close to a cached one
+    reuses its value only if the two query embeddings have cosine >= fuzzy_min_cosine."""
+
+    def __init__(
+        self,
+        maxsize: int = 2048,
+        ttl: float = 300.0,
+        namespace: str = "",
+        fuzzy_max_distance: Optional[int] = None,
+        version: Optional[Callable[[], Any]] = None,
+        embed: Optional[Callable[[str], Awaitable[Sequence[float]]]] = None,
+        fuzzy_min_cosine: float = 0.97
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self.fuzzy_max_distance = fuzzy_max_distance if embed is not None else None
+        self.fuzzy_min_cosine = fuzzy_min_cosine
+        self._embed = embed
+        self._version = version
+        self._current_version = version() if version else None
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._signatures: Deque[Tuple[int, str, str]] = deque(maxlen=maxsize)
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def make_key(self, message: str) -> str:
+        """Build the cache key from the normalized message and the namespace"""
+        payload = f"{normalize_query(message)}\x00{self.namespace}"
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _live_value(self, key: str) -> Tuple[bool, Any]:
+        """Return (found, value) for a non-expired entry, evicting it if expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _find_similar(self, signature: int) -> Optional[Tuple[str, str]]:
+        """Return (key, message) of the closest live cached query within the fuzzy distance"""
+        best = None
+        best_distance = self.fuzzy_max_distance + 1
+        for cached_signature, key, cached_message in self._signatures:
+            distance = (signature ^ cached_signature).bit_count()
+            if distance < best_distance and key in self._entries:
+                best, best_distance = (key, cached_message), distance
+        return best
+
+    async def _similar_value(self, message: str, candidate: Tuple[str, str]) -> Tuple[bool, Any]:
+        """Return (found, value) of a SimHash candidate whose query embedding is close enough.
+        Query embeddings normally come from the embedding LRU, so this costs no API call."""
+        key, cached_message = candidate
+        try:
+            vectors = np.asarray(
+                await asyncio.gather(self._embed(message), self._embed(cached_message)),
+                dtype=np.float32
+            )
+        except Exception:
+            return False, None
+        norms = np.linalg.norm(vectors, axis=1)
+        if not norms.all() or float(vectors[0] @ vectors[1]) / float(norms[0] * norms[1]) < self.fuzzy_min_cosine:
+            return False, None
+        async with self._lock:
+            return self._live_value(key)
+
+    async def get_or_compute(
+        self,
+        message: str,
+        compute: Callable[[str], Awaitable[Any]]
+    ) -> Any:
+        """Return the cached value for message, or await compute(message) and cache it.
+        Concurrent misses for the same key share a single compute call."""
+        key = self.make_key(message)
+        signature = None
+        candidate = None
+
+        async with self._lock:
+            self._check_version()
+            found, value = self._live_value(key)
+            if found:
+                self.hits += 1
+                return value
+            if self.fuzzy_max_distance is not None:
+                signature = simhash(normalize_query(message))
+                candidate = self._find_similar(signature)
+
+        # The cosine check may await embeddings, so it runs outside the lock
+        if candidate is not None:
+            found, value = await self._similar_value(message, candidate)
+            if found:
+                self.fuzzy_hits += 1
+                return value
+
+        async with self._lock:
+            found, value = self._live_value(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                inflight = asyncio.get_running_loop().create_future()
+                self._inflight[key] = inflight
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The computing request was cancelled; compute for this one instead
+                return await compute(message)
+
+        version = self._current_version
+        try:
+            value = await compute(message)
+        except asyncio.CancelledError:
+            self._inflight.pop(key, None)
+            inflight.cancel()
+            raise
+        except Exception as e:
+            self._inflight.pop(key, None)
+            inflight.set_exception(e)
+            # Mark the exception as retrieved in case nobody else is waiting on it
+            inflight.exception()
+            raise
+
+        async with self._lock:
+            self._inflight.pop(key, None)
+            if version == self._current_version:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                if signature is not None:
+                    self._signatures.append((signature, key, message))
+        inflight.set_result(value)
+
+        return value
+
+    def _check_version(self):
+        """Drop all entries when the data behind the cache has changed"""
+        if self._version is None:
+            return
+        version = self._version()
+        if version != self._current_version:
+            self._current_version = version
+            self.clear()
+
+    def clear(self):
+        """Drop all cached entries"""
+        self._entries.clear()
+        self._signatures.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters for the cache"""
+        total = self.hits + self.fuzzy_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.fuzzy_hits) / total if total else 0.0
+        }
+
+
+class EmbeddingCache:
+    """Persistent (model, sha256(text)) -> embedding cache in a local SQLite file.
+    Vectors are stored as float32 bytes."""
+
+    # Stay well under SQLite's bound-parameter limit in IN (...) lookups
+    _LOOKUP_BATCH = 500
+
+    def __init__(self, path: str, model: str):
+        self.model = model
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                hash BLOB NOT NULL,
+                model TEXT NOT NULL,
+                vec BLOB NOT NULL,
+                PRIMARY KEY (hash, model)
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def keys(texts: List[str]) -> List[bytes]:
+        """Cache keys (sha256 digests) of many texts"""
+        return [hashlib.sha256(text.encode()).digest() for text in texts]
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Get the cached embeddings among keys"""
+        found: Dict[bytes, List[float]] = {}
+        with self._lock:
+            for start in range(0, len(keys), self._LOOKUP_BATCH):
+                batch = keys[start:start + self._LOOKUP_BATCH]
+                placeholders = ", ".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    (self.model, *batch)
+                ).fetchall()
+                for key, vec in rows:
+                    found[key] = np.frombuffer(vec, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, List[float]]]):
+        """Store embeddings by key"""
+        rows = [
+            (key, self.model, np.asarray(embedding, dtype=np.float32).tobytes())
+            for key, embedding in items
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (hash, model, vec) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def close(self):
+        """Close the cache database"""
+        with self._lock:
+            self._conn.close()
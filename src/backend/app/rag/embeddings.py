@@ -1,19 +1,88 @@
-import sys
-from pathlib import Path
-from typing import List
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+import asyncio
+import hashlib
+import threading
 import google.generativeai as genai
+import numpy as np
 
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+from app.core.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.core.config import settings
+
+embedding_breaker = CircuitBreaker(
+    "gemini_embeddings",
+    fail_max=settings.LLM_BREAKER_FAIL_MAX,
+    reset_timeout=settings.LLM_BREAKER_RESET_SECONDS
+)
 
 
 class EmbeddingService:
+    # Query embeddings shared by every instance, as float32 arrays (~3KB each instead of ~25KB of floats);
+    # _embed_sync runs in worker threads, hence the threading lock
+    _cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+    _cache_lock = threading.Lock()
+    
     def __init__(self):
         genai.configure(api_key=settings.GEMINI_API_KEY)
         self.model = settings.GEMINI_EMBEDDING_MODEL
+        self.max_concurrent_embed = settings.EMBEDDING_MAX_CONCURRENT
+        self._embed_semaphore = asyncio.Semaphore(self.max_concurrent_embed)
+    
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[np.ndarray]:
+        """Get a cached embedding and mark it recently used; call with _cache_lock held"""
+        embedding = self._cache.get(key)
+        if embedding is not None:
+            self._cache.move_to_end(key)
+        return embedding
     
-    def _embed_sync(self, text: str, task_type: str) -> List[float]:
-        """Synchronous embedding generation"""
+    def _cache_put(self, key: Tuple[str, str], embedding: np.ndarray):
+        """Cache an embedding, evicting the least recently used; call with _cache_lock held"""
+        self._cache[key] = embedding
+        self._cache.move_to_end(key)
+        while len(self._cache) > settings.EMBEDDING_CACHE_SIZE:
+            self._cache.popitem(last=False)
+    
+    def _embed_sync(
+        self,
+        text: Union[str, List[str]],
+        task_type: str
+    ) -> Union[List[float], List[List[float]]]:
+        """Synchronous embedding generation; a list of texts is embedded in one API call.
+        Queries already embedded are served from the LRU cache. Documents skip it: they are
+        embedded by ingestion, whose persistent EmbeddingCache already covers them."""
+        if task_type != "retrieval_query":
+            return self._embed_api(text, task_type)
+        
+        single = isinstance(text, str)
+        texts = [text] if single else text
+        keys = [(task_type, hashlib.blake2b(t.encode(), digest_size=16).hexdigest()) for t in texts]
+        
+        with self._cache_lock:
+            cached = [self._cache_get(key) for key in keys]
+        embeddings = [None if embedding is None else embedding.tolist() for embedding in cached]
+        
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            content = texts[0] if single else [texts[i] for i in missing]
+            fetched = self._embed_api(content, task_type)
+            if single:
+                fetched = [fetched]
+            if len(fetched) != len(missing):
+                # Let the caller see the incomplete batch and fall back
+                return fetched
+            with self._cache_lock:
+                for i, embedding in zip(missing, fetched):
+                    embeddings[i] = embedding
+                    self._cache_put(keys[i], np.asarray(embedding, dtype=np.float32))
+        
+        return embeddings[0] if single else embeddings
+    
+    def _embed_api(
+        self,
+        text: Union[str, List[str]],
+        task_type: str
+    ) -> Union[List[float], List[List[float]]]:
+        """Call the embedding API"""
         try:
             result = genai.embed_content(
                 model=self.model,
@@ -29,19 +98,36 @@ class EmbeddingService:
     
     async def embed_text(self, text: str) -> List[float]:
         """Generate embedding for a single text"""
-        import asyncio
-        return await asyncio.to_thread(self._embed_sync, text, "retrieval_document")
+        return await embedding_breaker.call(asyncio.to_thread, self._embed_sync, text, "retrieval_document")
     
     async def embed_query(self, text: str) -> List[float]:
         """Generate embedding for a query"""
-        import asyncio
-        return await asyncio.to_thread(self._embed_sync, text, "retrieval_query")
+        return await embedding_breaker.call(asyncio.to_thread, self._embed_sync, text, "retrieval_query")
     
-    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts"""
-        embeddings = []
-        for text in texts:
-            embedding = await self.embed_text(text)
-            embeddings.append(embedding)
+    async def _embed_chunk(self, texts: List[str]) -> List[List[float]]:
+        """Embed one API batch, falling back to per-text calls if the batch comes back incomplete"""
+        try:
+            async with self._embed_semaphore:
+                embeddings = await embedding_breaker.call(
+                    asyncio.to_thread, self._embed_sync, texts, "retrieval_document"
+                )
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            if str(e).startswith("QUOTA_EXCEEDED"):
+                raise
+            embeddings = None
+        
+        if not embeddings or len(embeddings) != len(texts) or not isinstance(embeddings[0], list):
+            return [await self.embed_text(text) for text in texts]
         return embeddings
-
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for multiple texts, EMBEDDING_BATCH_SIZE texts per API call,
+        with up to EMBEDDING_MAX_CONCURRENT calls in flight"""
+        batch_size = settings.EMBEDDING_BATCH_SIZE
+        chunk_results = await asyncio.gather(*[
+            self._embed_chunk(texts[start:start + batch_size])
+            for start in range(0, len(texts), batch_size)
+        ])
+        return [embedding for chunk in chunk_results for embedding in chunk]
@@ -1,100 +1,104 @@
 import asyncio
-import requests
+import httpx
 from bs4 import BeautifulSoup
-import html2text
 from typing import List, Dict, Any
 from pathlib import Path
-import sys
 import hashlib
+import random
 import time
 import json
+import os
 
+from app.core.rate_limiter import TokenBucket
+from app.rag.embed_cache import EmbeddingCache
 from app.rag.embeddings import EmbeddingService
 from app.rag.vectorstore import VectorStore
+from app.core.config import settings
 
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+# Tags whose content is page chrome or non-text, dropped before extracting text
+_STRIP_TAGS = frozenset(("script", "style", "nav", "footer", "header", "noscript", "iframe", "svg"))
 
 
 class IngestionService:
     def __init__(self):
         self.embedding_service = EmbeddingService()
         self.vectorstore = VectorStore()
+        self.embedding_cache = EmbeddingCache(
+            str(Path(self.vectorstore._db_path).parent / "embedding_cache.db"),
+            settings.GEMINI_EMBEDDING_MODEL
+        )
         self.chunk_size = settings.CHUNK_SIZE
         self.chunk_overlap = settings.CHUNK_OVERLAP
-        self.html_converter = html2text.HTML2Text()
-        self.html_converter.ignore_links = False
-        self.html_converter.ignore_images = True
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+            timeout=10,
+            follow_redirects=True,
+            headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+        )
         
-        self.rate_limit_delay = 1.2
-        self.embedding_batch_delay = 2.0
+        self.embedding_batch_size = settings.EMBEDDING_BATCH_SIZE
+        self.embedding_concurrency = settings.INGESTION_EMBED_CONCURRENCY
+        self.rate_limiter = TokenBucket(settings.EMBEDDING_RPM)
+        self.progress_flush_every = 5
+        self.pipeline_depth = 4
         self.max_retries = 3
         self.retry_delay = 5
     
     def _chunk_text(self, text: str, url: str) -> List[Dict[str, Any]]:
         """Split text into chunks with overlap"""
-        chunks = []
-        start = 0
-        chunk_index = 0
-        
-        while start < len(text):
-            end = start + self.chunk_size
-            chunk_text = text[start:end].strip()
-            
-            if chunk_text:
-                chunks.append({
-                    "text": chunk_text,
-                    "url": url,
-                    "chunk_index": chunk_index,
-                    "start": start,
-                    "end": end
-                })
-                chunk_index += 1
-            
-            start = end - self.chunk_overlap
+        size = self.chunk_size
+        starts = range(0, len(text), max(1, size - self.chunk_overlap))
+        pieces = [
+            (start, piece)
+            for start, piece in ((start, text[start:start + size]) for start in starts)
+            if not piece.isspace()
+        ]
+        return [
+            {
+                "text": piece.strip(),
+                "url": url,
+                "chunk_index": chunk_index,
+                "start": start,
+                "end": start + size
+            }
+            for chunk_index, (start, piece) in enumerate(pieces)
+        ]
+    
+    @staticmethod
+    def _extract_text(content: bytes) -> str:
+        """Parse HTML and extract its text without boilerplate tags"""
+        soup = BeautifulSoup(content, 'html.parser')
         
-        return chunks
+        for tag in soup.find_all(_STRIP_TAGS):
+            tag.decompose()
+        
+        return soup.get_text(separator='\n', strip=True)
     
     async def _scrape_url(self, url: str) -> str:
         """Scrape and extract text from URL"""
         try:
-            response = requests.get(url, timeout=10, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
+            response = await self._client.get(url)
             response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            for script in soup(["script", "style", "nav", "footer", "header"]):
-                script.decompose()
-            
-            text = self.html_converter.handle(str(soup))
-            return text.strip()
+            # Parsing is CPU-bound; keep it off the event loop so embedding keeps running
+            return await asyncio.to_thread(self._extract_text, response.content)
         except Exception as e:
             print(f"Error scraping {url}: {str(e)}")
             return ""
     
-    async def _embed_with_retry(self, texts: List[str], url: str) -> List[List[float]]:
-        """Generate embeddings with retry logic and rate limiting"""
+    async def _embed_batch_with_retry(self, texts: List[str]) -> List[List[float]]:
+        """Embed one provider batch with retry logic"""
         for attempt in range(self.max_retries):
+            await self.rate_limiter.acquire()
             try:
-                embeddings = []
-                for i, text in enumerate(texts):
-                    if i > 0:
-                        await asyncio.sleep(self.rate_limit_delay)
-                    
-                    embedding = await self.embedding_service.embed_text(text)
-                    embeddings.append(embedding)
-                    
-                    if (i + 1) % 10 == 0:
-                        print(f"    Embedded {i + 1}/{len(texts)} chunks...")
-                        await asyncio.sleep(self.embedding_batch_delay)
-                
+                embeddings = await self.embedding_service.embed_batch(texts)
+                self.rate_limiter.on_success()
                 return embeddings
             except Exception as e:
                 if "quota" in str(e).lower() or "rate limit" in str(e).lower():
-                    wait_time = self.retry_delay * (2 ** attempt)
-                    print(f"  Rate limit hit. Waiting {wait_time}s before retry {attempt + 1}/{self.max_retries}...")
+                    self.rate_limiter.on_rate_limited()
+                    # Jitter keeps concurrent batches from retrying in lockstep
+                    wait_time = self.retry_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                    print(f"  Rate limit hit. Waiting {wait_time:.1f}s before retry {attempt + 1}/{self.max_retries}...")
                     await asyncio.sleep(wait_time)
                 else:
                     print(f"  Error generating embeddings: {str(e)}")
@@ -104,33 +108,78 @@ class IngestionService:
                         raise
         raise Exception("Failed to generate embeddings after retries")
     
-    async def ingest_url(self, url: str):
-        """Ingest a single URL with rate limiting"""
-        print(f"\nProcessing {url}...")
+    async def _embed_with_retry(self, texts: List[str], url: str) -> List[List[float]]:
+        """Generate embeddings in provider-sized batches, up to embedding_concurrency
+        batches in flight, retrying each batch independently"""
+        semaphore = asyncio.Semaphore(self.embedding_concurrency)
+        embeddings: List[List[float]] = [None] * len(texts)
+        done = 0
         
+        async def embed_slice(start: int):
+            nonlocal done
+            batch = texts[start:start + self.embedding_batch_size]
+            async with semaphore:
+                embeddings[start:start + len(batch)] = await self._embed_batch_with_retry(batch)
+            done += len(batch)
+            print(f"    Embedded {done}/{len(texts)} chunks...")
+        
+        await asyncio.gather(*[
+            embed_slice(start) for start in range(0, len(texts), self.embedding_batch_size)
+        ])
+        return embeddings
+    
+    async def _extract_chunks(self, url: str) -> List[Dict[str, Any]]:
+        """Scrape a URL and split its text into chunks"""
         text = await self._scrape_url(url)
         
         if not text:
             print(f"  No content extracted from {url}")
-            return 0
-        
-        print(f"  Extracted {len(text)} characters")
+            return []
         
         chunks = self._chunk_text(text, url)
-        print(f"  Created {len(chunks)} chunks")
+        print(f"  Extracted {len(text)} characters from {url} into {len(chunks)} chunks")
+        return chunks
+    
+    async def _store_chunks(self, url: str, chunks: List[Dict[str, Any]]) -> int:
+        """Embed a URL's chunks (reusing cached embeddings) and store them in the vector DB"""
+        print(f"\nStoring {url}...")
         
-        if not chunks:
-            return 0
+        url_key = hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+        ids = [f"{url_key}:{chunk['chunk_index']}" for chunk in chunks]
+        
+        # A resumed run may find part of this URL already stored; only the rest is embedded
+        existing = self.vectorstore.existing_ids(ids)
+        if existing:
+            missing = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+            print(f"  {len(existing)} chunks already stored, {len(missing)} remaining")
+            if not missing:
+                return 0
+            chunks = [chunks[i] for i in missing]
+            ids = [ids[i] for i in missing]
         
         texts = [chunk["text"] for chunk in chunks]
-        print(f"  Generating embeddings (this may take a while due to rate limits)...")
+        keys = EmbeddingCache.keys(texts)
+        cached = self.embedding_cache.get_many(keys)
+        
+        # Boilerplate repeated across a page is embedded once and fanned out
+        uncached: Dict[bytes, List[int]] = {}
+        for i, key in enumerate(keys):
+            if key not in cached:
+                uncached.setdefault(key, []).append(i)
+        print(f"  {len(texts) - sum(map(len, uncached.values()))} embeddings cached, generating {len(uncached)} unique...")
         
         try:
-            embeddings = await self._embed_with_retry(texts, url)
+            generated = await self._embed_with_retry([texts[indices[0]] for indices in uncached.values()], url)
         except Exception as e:
             print(f"  Failed to generate embeddings: {str(e)}")
             return 0
         
+        self.embedding_cache.put_many(zip(uncached.keys(), generated))
+        embeddings = [cached.get(key) for key in keys]
+        for indices, embedding in zip(uncached.values(), generated):
+            for i in indices:
+                embeddings[i] = embedding
+        
         metadatas = [
             {
                 "url": chunk["url"],
@@ -140,11 +189,6 @@ class IngestionService:
             for chunk in chunks
         ]
         
-        ids = [
-            hashlib.md5(f"{url}_{chunk['chunk_index']}".encode()).hexdigest()
-            for chunk in chunks
-        ]
-        
         await self.vectorstore.add_documents(
             texts=texts,
             embeddings=embeddings,
@@ -155,6 +199,27 @@ class IngestionService:
         print(f"  Stored {len(chunks)} chunks in vector DB")
         return len(chunks)
     
+    async def ingest_url(self, url: str):
+        """Ingest a single URL"""
+        print(f"\nProcessing {url}...")
+        chunks = await self._extract_chunks(url)
+        if not chunks:
+            return 0
+        return await self._store_chunks(url, chunks)
+    
+    async def aclose(self):
+        """Close the HTTP client and the embedding cache"""
+        await self._client.aclose()
+        self.embedding_cache.close()
+    
+    @staticmethod
+    def _write_progress(progress_file: Path, processed_urls: set):
+        """Atomically replace the progress file with the processed URL list"""
+        tmp_file = progress_file.with_suffix(".tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump({'processed_urls': list(processed_urls)}, f, separators=(',', ':'))
+        os.replace(tmp_file, progress_file)
+    
     async def ingest_all(self, urls: List[str] = None, resume: bool = False):
         """Ingest all URLs from config with progress tracking"""
         if urls is None:
@@ -162,8 +227,8 @@ class IngestionService:
         
         print(f"Starting ingestion of {len(urls)} URLs...")
         print(f"Vector DB location: {self.vectorstore._db_path}")
-        print(f"Rate limit: {self.rate_limit_delay}s between embeddings")
-        print(f"Batch delay: {self.embedding_batch_delay}s every 10 embeddings\n")
+        print(f"Embedding batch size: {self.embedding_batch_size} chunks per request")
+        print(f"Embedding rate limit: {self.rate_limiter.rpm:.0f} requests per minute\n")
         
         if not resume:
             self.vectorstore.clear_collection()
@@ -181,32 +246,61 @@ class IngestionService:
             except:
                 pass
         
-        total_chunks = 0
-        for i, url in enumerate(urls, 1):
+        pending_urls = []
+        for url in urls:
             if url in processed_urls:
                 print(f"\nSkipping {url} (already processed)")
-                continue
-            
-            try:
-                chunks = await self.ingest_url(url)
-                total_chunks += chunks
-                processed_urls.add(url)
-                
-                with open(progress_file, 'w') as f:
-                    json.dump({'processed_urls': list(processed_urls)}, f)
-                
-                if i < len(urls):
-                    delay = 3.0
-                    print(f"  Waiting {delay}s before next URL (rate limit protection)...")
-                    await asyncio.sleep(delay)
-            except Exception as e:
-                print(f"  Error processing {url}: {str(e)}")
-                print(f"  You can resume later with --resume flag")
-                if "quota" in str(e).lower() or "rate limit" in str(e).lower():
-                    print(f"  Rate limit exceeded. Please wait and resume later.")
+            else:
+                pending_urls.append(url)
+        
+        # Scraping runs ahead of embedding: the producer fills the queue while the consumer embeds and stores
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.pipeline_depth)
+        
+        async def produce():
+            for url in pending_urls:
+                try:
+                    chunks = await self._extract_chunks(url)
+                except Exception as e:
+                    chunks = e
+                await queue.put((url, chunks))
+            await queue.put(None)
+        
+        producer = asyncio.create_task(produce())
+        total_chunks = 0
+        unsaved = 0
+        completed = False
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    completed = True
                     break
+                url, chunks = item
+                
+                try:
+                    if isinstance(chunks, Exception):
+                        raise chunks
+                    if chunks:
+                        total_chunks += await self._store_chunks(url, chunks)
+                    processed_urls.add(url)
+                    
+                    unsaved += 1
+                    if unsaved >= self.progress_flush_every:
+                        self._write_progress(progress_file, processed_urls)
+                        unsaved = 0
+                except Exception as e:
+                    print(f"  Error processing {url}: {str(e)}")
+                    print(f"  You can resume later with --resume flag")
+                    if "quota" in str(e).lower() or "rate limit" in str(e).lower():
+                        print(f"  Rate limit exceeded. Please wait and resume later.")
+                        break
+        finally:
+            producer.cancel()
+            if unsaved and not completed:
+                self._write_progress(progress_file, processed_urls)
         
-        if progress_file.exists():
+        # Keep the progress file when the run stopped early so it can be resumed
+        if completed and progress_file.exists():
             progress_file.unlink()
         
         print(f"\nIngestion complete!")
@@ -1,32 +1,72 @@
+import re
 from typing import List, Dict, Any, Optional
+from app.rag.embed_cache import AsyncLRUCache
 from app.rag.embeddings import EmbeddingService
 from app.rag.vectorstore import VectorStore
-import sys
-from pathlib import Path
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
+from app.core.circuit_breaker import CircuitOpenError
+from app.core.llm_pool import get_llm, llm_breaker
 from app.utils.logger import setup_logger
-
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+from app.core.config import settings
 
 logger = setup_logger("retriever")
 
+_WORD_RE = re.compile(r"[a-zà-öø-ÿ]+")
+
+_PT_STOPWORDS = frozenset((
+    "não", "que", "de", "da", "do", "das", "dos", "para", "pra", "com", "uma", "um", "é", "são",
+    "como", "onde", "qual", "quais", "quando", "porque", "meu", "minha", "meus", "minhas", "você",
+    "vocês", "está", "estou", "isso", "esse", "essa", "este", "esta", "também", "mais", "mas", "ou",
+    "no", "na", "nos", "nas", "ao", "à", "em", "se", "posso", "tenho", "sobre", "seu", "sua", "eu"
+))
+
+_OTHER_STOPWORDS = frozenset((
+    "the", "is", "are", "what", "how", "my", "i", "you", "to", "of", "and", "can", "does", "where",
+    "which", "why", "for", "with", "an", "it", "this", "that",
+    # Spanish function words; words shared with Portuguese still count here, so Spanish errs towards translation
+    "el", "la", "los", "las", "del", "una", "en", "por", "con", "es", "está", "y", "mi", "cómo", "cuál",
+    "qué", "usted", "puedo", "tengo", "quiero"
+))
+
+
+def is_probably_portuguese(text: str) -> bool:
+    """Cheap stopword vote deciding whether a query is already in Portuguese.
+    Errs towards False so ambiguous queries still go through translation."""
+    tokens = _WORD_RE.findall(text.casefold())
+    portuguese = sum(token in _PT_STOPWORDS for token in tokens)
+    other = sum(token in _OTHER_STOPWORDS for token in tokens)
+    if "ã" in text or "õ" in text or "ç" in text:
+        portuguese += 1
+    return portuguese >= 2 and portuguese > 2 * other
+
 
 class Retriever:
     def __init__(self):
         self.embedding_service = EmbeddingService()
         self.vectorstore = VectorStore()
         self.top_k = settings.RETRIEVAL_TOP_K
-        self.llm = ChatGoogleGenerativeAI(
-            model=settings.GEMINI_MODEL,
-            google_api_key=settings.GEMINI_API_KEY,
-            temperature=0.1
+        self.llm = get_llm(0.1)
+        self.cache = AsyncLRUCache(
+            maxsize=settings.RETRIEVAL_CACHE_SIZE,
+            ttl=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+            namespace=settings.GEMINI_EMBEDDING_MODEL,
+            fuzzy_max_distance=(
+                settings.RETRIEVAL_CACHE_FUZZY_MAX_DISTANCE
+                if settings.RETRIEVAL_CACHE_FUZZY_ENABLED else None
+            ),
+            version=lambda: self.vectorstore.generation,
+            embed=self.embedding_service.embed_query,
+            fuzzy_min_cosine=settings.RETRIEVAL_CACHE_FUZZY_MIN_COSINE
         )
     
     async def _translate_to_portuguese(self, query: str) -> str:
-        """Translate query to Portuguese for better vector DB matching"""
+        """Translate query to Portuguese for better vector DB matching.
+        An empty or unchanged reply keeps the original query string."""
+        if is_probably_portuguese(query):
+            logger.debug("Query already in Portuguese: '%.100s'", query)
+            return query
+        
         try:
             prompt = f"""Translate the following query to Portuguese (Brazil). 
 If it's already in Portuguese, return it unchanged. 
@@ -36,38 +76,54 @@ Query: "{query}"
 
 Translation:"""
             
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            response = await llm_breaker.call(self.llm.ainvoke, [HumanMessage(content=prompt)])
             translated = response.content.strip().strip('"').strip("'")
             
-            if translated != query:
-                logger.info(f"Translated query to Portuguese - Original: '{query[:100]}...' | Translated: '{translated[:100]}...'")
-            else:
-                logger.debug(f"Query already in Portuguese: '{query[:100]}...'")
+            if translated and translated != query:
+                logger.info(
+                    "Translated query to Portuguese - Original: '%s...' | Translated: '%s...'",
+                    query[:100], translated[:100]
+                )
+                return translated
             
-            return translated
+            logger.debug("Query already in Portuguese: '%.100s'", query)
+            return query
         except Exception as e:
-            logger.warning(f"Translation failed, using original query: {str(e)}")
+            logger.warning("Translation failed, using original query: %s", e)
             return query
     
     async def retrieve(self, query: str, top_k: Optional[int] = None, max_retries: int = 3) -> List[Dict[str, Any]]:
         """Retrieve relevant chunks for a query with retry logic.
-        Translates query to Portuguese before embedding since all data is in Portuguese."""
+        Results for the default top_k are cached by normalized query, so a repeated question
+        skips translation, embedding and search."""
+        if top_k is None or top_k == self.top_k:
+            return await self.cache.get_or_compute(
+                query,
+                lambda q: self._retrieve_uncached(q, self.top_k, max_retries)
+            )
+        return await self._retrieve_uncached(query, top_k, max_retries)
+    
+    async def _retrieve_uncached(self, query: str, top_k: int, max_retries: int) -> List[Dict[str, Any]]:
+        """Translate query to Portuguese before embedding since all data is in Portuguese, then search"""
         import asyncio
         
-        if top_k is None:
-            top_k = self.top_k
-        
-        translated_query = await self._translate_to_portuguese(query)
+        search_query = await self._translate_to_portuguese(query)
         
+        # Embedded once per final query string; a retry after a failed search reuses it.
+        # An untranslated query is usually already in the embedding LRU from intent classification.
+        query_embedding = None
         for attempt in range(max_retries):
             try:
-                query_embedding = await self.embedding_service.embed_query(translated_query)
+                if query_embedding is None:
+                    query_embedding = await self.embedding_service.embed_query(search_query)
                 results = await self.vectorstore.search(
                     query_embedding=query_embedding,
                     top_k=top_k,
                     min_score=0.3
                 )
                 return results
+            except CircuitOpenError:
+                raise
             except Exception as e:
                 error_str = str(e)
                 if "QUOTA_EXCEEDED" in error_str or "429" in error_str:
@@ -1,17 +1,27 @@
 import chromadb
+import numpy as np
 from chromadb.config import Settings
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from pathlib import Path
-import sys
 
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config import settings
+from app.core.config import settings
+
+# Below Chroma's max batch size for its default SQLite settings (~5461)
+_UPSERT_BATCH_SIZE = 5000
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row so distances only depend on direction"""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
 
 
 class VectorStore:
     _instance = None
     _client = None
     _collection = None
+    _generation = 0
     
     def __new__(cls):
         if cls._instance is None:
@@ -34,6 +44,11 @@ class VectorStore:
             self._collection_name = "scraped_docs"
             self._initialized = True
     
+    @property
+    def generation(self) -> int:
+        """Counter bumped whenever documents are written or cleared in this process"""
+        return self._generation
+    
     def _get_client(self):
         """Get or create ChromaDB client"""
         if self._client is None:
@@ -59,18 +74,31 @@ class VectorStore:
     async def add_documents(
         self,
         texts: List[str],
-        embeddings: List[List[float]],
+        embeddings: Union[List[List[float]], np.ndarray],
         metadatas: List[Dict[str, Any]],
         ids: List[str]
     ):
-        """Add documents to the vector store"""
+        """Add or replace documents in the vector store, in batches Chroma accepts in one write"""
         collection = self.get_collection()
-        collection.add(
-            embeddings=embeddings,
-            documents=texts,
-            metadatas=metadatas,
-            ids=ids
-        )
+        # Chroma's index is float32; a float32 matrix skips per-float Python object conversion
+        matrix = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        for start in range(0, len(ids), _UPSERT_BATCH_SIZE):
+            end = start + _UPSERT_BATCH_SIZE
+            collection.upsert(
+                embeddings=matrix[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
+            )
+        VectorStore._generation += 1
+    
+    def existing_ids(self, ids: List[str]) -> set:
+        """Get the subset of ids already stored in the collection"""
+        collection = self.get_collection()
+        found = set()
+        for start in range(0, len(ids), _UPSERT_BATCH_SIZE):
+            found.update(collection.get(ids=ids[start:start + _UPSERT_BATCH_SIZE], include=[])['ids'])
+        return found
     
     async def search(
         self,
@@ -81,26 +109,33 @@ class VectorStore:
         """Search for similar documents"""
         collection = self.get_collection()
         
+        query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
         results = collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=[query],
             n_results=top_k
         )
         
-        documents = []
-        if results['documents'] and len(results['documents'][0]) > 0:
-            for i, doc in enumerate(results['documents'][0]):
-                distance = results['distances'][0][i] if results.get('distances') else 0.0
-                similarity = 1.0 - distance
-                
-                if similarity >= min_score:
-                    documents.append({
-                        "text": doc,
-                        "metadata": results['metadatas'][0][i] if results.get('metadatas') else {},
-                        "similarity": similarity,
-                        "id": results['ids'][0][i] if results.get('ids') else None
-                    })
+        if not results['documents'] or not results['documents'][0]:
+            return []
+        
+        texts = results['documents'][0]
+        if results.get('distances'):
+            similarities = 1.0 - np.asarray(results['distances'][0], dtype=np.float64)
+        else:
+            similarities = np.ones(len(texts))
+        metadatas = results['metadatas'][0] if results.get('metadatas') else None
+        ids = results['ids'][0] if results.get('ids') else None
         
-        return documents
+        # Filter all hits in one comparison and only build dicts for the survivors
+        return [
+            {
+                "text": texts[i],
+                "metadata": metadatas[i] if metadatas else {},
+                "similarity": float(similarities[i]),
+                "id": ids[i] if ids else None
+            }
+            for i in np.flatnonzero(similarities >= min_score)
+        ]
     
     def clear_collection(self):
         """Clear all documents from collection (for re-ingestion)"""
@@ -108,6 +143,7 @@ class VectorStore:
         try:
             client.delete_collection(name=self._collection_name)
             self._collection = None
+            VectorStore._generation += 1
         except:
             pass
     
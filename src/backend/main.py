@@ -31,6 +31,12 @@ async def startup():
     testing_agent = TestingAgent()
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the shared database connection"""
+    await db.close()
+
+
 @app.get("/")
 async def root():
     return {"message": "Legion Backend API", "version": "1.0.0"}
@@ -31,6 +31,7 @@ class HealthResponse(BaseModel):
     agents: Dict[str, str]
     vector_db: str
     gemini_api: str
+    circuit_breakers: Dict[str, str] = {}
 
 
 class AgentInfo(BaseModel):
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from datetime import datetime
+import json
 from typing import Dict, Any
 
 from models import (
@@ -12,20 +14,17 @@ from models import (
 )
 from app.agents.router import RouterAgent
 from app.core.agent_registry import AgentRegistry
+from app.core.circuit_breaker import breaker_states
+from app.core.llm_pool import get_llm, llm_breaker
 from app.models.agent_metadata import IntentType
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
-from config import settings
+from app.core.config import settings
 
 router = APIRouter(prefix="/api", tags=["agents"])
 
 router_agent = RouterAgent()
 registry = AgentRegistry()
-llm = ChatGoogleGenerativeAI(
-    model=settings.GEMINI_MODEL,
-    google_api_key=settings.GEMINI_API_KEY,
-    temperature=0.7
-)
+llm = get_llm(0.7)
 
 
 @router.post("/chat", response_model=ChatResponse)
@@ -50,6 +49,22 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream chat responses through the agent system as server-sent events"""
+    context = {
+        "message": request.message,
+        "user_id": request.user_id,
+        "timestamp": datetime.now()
+    }
+    
+    async def events():
+        async for frame in router_agent.stream(context):
+            yield f"data: {json.dumps(frame, default=str)}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @router.post("/test", response_model=TestResponse)
 async def test(request: TestRequest):
     """Trigger testing agent to validate knowledge agent responses"""
@@ -84,7 +99,7 @@ async def health():
     """System health check"""
     try:
         test_message = HumanMessage(content="test")
-        await llm.ainvoke([test_message])
+        await llm_breaker.call(llm.ainvoke, [test_message])
         gemini_status = "connected"
     except Exception:
         gemini_status = "disconnected"
@@ -98,7 +113,8 @@ async def health():
             "testing": "healthy"
         },
         vector_db="ready",
-        gemini_api=gemini_status
+        gemini_api=gemini_status,
+        circuit_breakers=breaker_states()
     )
 
 
@@ -14,7 +14,10 @@ async def main():
     args = parser.parse_args()
     
     ingestion = IngestionService()
-    await ingestion.ingest_all(resume=args.resume)
+    try:
+        await ingestion.ingest_all(resume=args.resume)
+    finally:
+        await ingestion.aclose()
 
 
 if __name__ == "__main__":
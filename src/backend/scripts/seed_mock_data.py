@@ -1,90 +1,97 @@
+import argparse
 import asyncio
 import sys
+from itertools import chain
+from operator import itemgetter
 from pathlib import Path
+from typing import List, Sequence, Tuple
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from app.data.database import db
 
+# SQLite's default bound-parameter limit (SQLITE_MAX_VARIABLE_NUMBER) since 3.32
+_MAX_PARAMS = 32766
 
-async def seed_mock_data():
-    """Seed database with mock user data"""
+# Seed rows are tuples in this column order
+_USER_COLUMNS = ("user_id", "name", "email", "balance", "status")
+_TRANSACTION_COLUMNS = ("transaction_id", "user_id", "amount", "type", "description")
+
+
+async def _insert_rows(conn, table: str, columns: Sequence[str], rows: List[Tuple]):
+    """Insert rows with multi-row VALUES statements, as few as the bound-parameter limit allows.
+    Plain INSERT: the caller clears conflicting rows first."""
+    row_placeholders = f"({', '.join('?' * len(columns))})"
+    rows_per_statement = _MAX_PARAMS // len(columns)
+    for start in range(0, len(rows), rows_per_statement):
+        batch = rows[start:start + rows_per_statement]
+        await conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES {', '.join([row_placeholders] * len(batch))}",
+            list(chain.from_iterable(batch))
+        )
+
+
+async def _write_seed(conn, users: List[Tuple], transactions: List[Tuple]):
+    """Replace the seed rows; only the seed's own rows are cleared, users created through the app are kept"""
+    user_ids = [user[0] for user in users]
+    transaction_ids = [txn[0] for txn in transactions]
+    await conn.execute(
+        f"DELETE FROM transactions WHERE transaction_id IN ({', '.join('?' * len(transaction_ids))})",
+        transaction_ids
+    )
+    await conn.execute(
+        f"DELETE FROM users WHERE user_id IN ({', '.join('?' * len(user_ids))})",
+        user_ids
+    )
+    # The first column is the primary key; ascending keys fill B-tree pages left to right
+    await _insert_rows(conn, "users", _USER_COLUMNS, sorted(users, key=itemgetter(0)))
+    await _insert_rows(conn, "transactions", _TRANSACTION_COLUMNS, sorted(transactions, key=itemgetter(0)))
+
+
+async def seed_mock_data(force: bool = False):
+    """Seed database with mock user data; skipped when every seed row already exists unless force is set"""
     await db.initialize()
     
     mock_users = [
-        {
-            "user_id": "user_001",
-            "name": "João Silva",
-            "email": "joao.silva@example.com",
-            "balance": 1250.50,
-            "status": "active"
-        },
-        {
-            "user_id": "user_002",
-            "name": "Maria Santos",
-            "email": "maria.santos@example.com",
-            "balance": 3500.00,
-            "status": "active"
-        },
-        {
-            "user_id": "user_003",
-            "name": "Pedro Oliveira",
-            "email": "pedro.oliveira@example.com",
-            "balance": 500.25,
-            "status": "active"
-        }
+        ("user_001", "João Silva", "joao.silva@example.com", 1250.50, "active"),
+        ("user_002", "Maria Santos", "maria.santos@example.com", 3500.00, "active"),
+        ("user_003", "Pedro Oliveira", "pedro.oliveira@example.com", 500.25, "active")
     ]
     
     mock_transactions = [
-        {
-            "transaction_id": "txn_001",
-            "user_id": "user_001",
-            "amount": 100.00,
-            "type": "payment_received",
-            "description": "Payment from customer"
-        },
-        {
-            "transaction_id": "txn_002",
-            "user_id": "user_001",
-            "amount": -50.00,
-            "type": "transfer",
-            "description": "Transfer to account"
-        },
-        {
-            "transaction_id": "txn_003",
-            "user_id": "user_002",
-            "amount": 250.00,
-            "type": "payment_received",
-            "description": "Payment from customer"
-        }
+        ("txn_001", "user_001", 100.00, "payment_received", "Payment from customer"),
+        ("txn_002", "user_001", -50.00, "transfer", "Transfer to account"),
+        ("txn_003", "user_002", 250.00, "payment_received", "Payment from customer")
     ]
     
-    import aiosqlite
+    user_ids = [user[0] for user in mock_users]
+    transaction_ids = [txn[0] for txn in mock_transactions]
     
-    async with aiosqlite.connect(db._db_path) as conn:
-        for user in mock_users:
-            await conn.execute(
-                """INSERT OR REPLACE INTO users 
-                   (user_id, name, email, balance, status)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (user["user_id"], user["name"], user["email"], 
-                 user["balance"], user["status"])
-            )
-        
-        for txn in mock_transactions:
-            await conn.execute(
-                """INSERT OR REPLACE INTO transactions 
-                   (transaction_id, user_id, amount, type, description)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (txn["transaction_id"], txn["user_id"], txn["amount"],
-                 txn["type"], txn["description"])
-            )
+    # One transaction on the app's shared connection; the seed can simply be re-run, so it skips fsync
+    async with db.transaction(durable=False) as conn:
+        async with conn.execute(
+            f"""SELECT
+                   (SELECT COUNT(*) FROM users WHERE user_id IN ({', '.join('?' * len(user_ids))})),
+                   (SELECT COUNT(*) FROM transactions WHERE transaction_id IN ({', '.join('?' * len(transaction_ids))}))""",
+            user_ids + transaction_ids
+        ) as cursor:
+            users_found, transactions_found = await cursor.fetchone()
+        already_seeded = users_found == len(user_ids) and transactions_found == len(transaction_ids)
         
-        await conn.commit()
+        if not already_seeded or force:
+            await _write_seed(conn, mock_users, mock_transactions)
     
-    print(f"Seeded {len(mock_users)} users and {len(mock_transactions)} transactions")
+    if already_seeded and not force:
+        print("Mock data already seeded (use --force to reset it)")
+    else:
+        print(f"Seeded {len(mock_users)} users and {len(mock_transactions)} transactions")
     print(f"Database location: {db._db_path}")
+    await db.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(seed_mock_data())
+    parser = argparse.ArgumentParser(description='Seed the database with mock users and transactions')
+    parser.add_argument('--force', action='store_true', help='Rewrite the seed rows even if they already exist')
+    args = parser.parse_args()
+    asyncio.run(seed_mock_data(force=args.force))
 
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from app.rag.retriever import is_probably_portuguese
+
+
+def test_portuguese_query_is_detected():
+    assert is_probably_portuguese("Como eu posso alterar a senha da minha conta?")
+
+
+def test_english_query_is_not_portuguese():
+    assert not is_probably_portuguese("How can I change the password of my account?")
+
+
+def test_spanish_query_is_not_portuguese():
+    assert not is_probably_portuguese("Quiero saber de la tarifa de envío para una compra en la tienda")